@@ -8,6 +8,7 @@ from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
 from api.v1.auth.auth import Auth  # Import the Auth class
 from api.v1.auth.basic_auth import BasicAuth  # Import the BasicAuth class
+from api.v1.auth.route_policy import OPTIONAL, PUBLIC, RoutePolicy
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
@@ -26,6 +27,14 @@ else:
     # Default to Auth if no special authentication type is set
     auth = Auth()
 
+# Authentication mode of each route, compiled once; other routes require
+# authentication
+route_policy = RoutePolicy({
+    '/api/v1/status/': PUBLIC,
+    '/api/v1/unauthorized/': PUBLIC,
+    '/api/v1/forbidden/': PUBLIC,
+})
+
 
 @app.before_request
 def before_request():
@@ -37,19 +46,17 @@ def before_request():
     if auth is None:
         return None
 
-    # List of routes that do not require authentication
-    excluded_paths = [
-            '/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/'
-            ]
-
-    # If the path requires authentication
-    if auth.require_auth(request.path, excluded_paths):
+    # If the path requires (or accepts) authentication
+    if auth.require_auth(request.path, route_policy):
+        optional = route_policy.mode(request.path) == OPTIONAL
         # Check if Authorization header is present
         if auth.authorization_header(request) is None:
+            if optional:
+                return None
             abort(401)  # Unauthorized error
 
         # Check if the current user exists
-        if auth.current_user(request) is None:
+        if auth.current_user(request) is None and not optional:
             abort(403)  # Forbidden error
 
 
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """Module to manage API authentication."""
-from typing import List, TypeVar
+from typing import List, TypeVar, Union
 from flask import request
+from api.v1.auth.route_policy import PUBLIC, RoutePolicy, compile_paths
 
 # Define a TypeVar named User
 User = TypeVar('User')
@@ -10,38 +11,29 @@ User = TypeVar('User')
 class Auth:
     """Template class for API authentication management."""
 
-    def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
+    def require_auth(self, path: str,
+                     excluded_paths: Union[List[str], RoutePolicy]) -> bool:
         """
         Determines if authentication is required for a given path.
 
         Args:
             path (str): The path to check.
-            excluded_paths (List[str]): A list of paths that do not
-            require authentication.
+            excluded_paths (List[str] or RoutePolicy): A list of paths
+            that do not require authentication (a trailing `*` matches
+            any suffix), or a RoutePolicy built once at startup.
 
         Returns:
-            bool: True if authentication is required, False otherwise.
+            bool: True if authentication is required (or optional),
+            False if the path is public.
         """
         if path is None or not excluded_paths:
             return True
 
-        # Ensure path ends with a slash for uniform comparison
-        if path[-1] != '/':
-            path += '/'
-
-        for excluded_path in excluded_paths:
-            # Handle wildcard (*) for prefix matching
-            if excluded_path.endswith('*'):
-                if path.startswith(excluded_path[:-1]):
-                    return False
-            else:
-                # Add trailing slash if missing for exact match comparison
-                if excluded_path[-1] != '/':
-                    excluded_path += '/'
-                if path == excluded_path:
-                    return False
-
-        return True
+        # A plain list is compiled once, then looked up in O(len(path))
+        if not isinstance(excluded_paths, RoutePolicy):
+            excluded_paths = compile_paths(tuple(excluded_paths))
+
+        return excluded_paths.mode(path) != PUBLIC
 
     def authorization_header(self, request=None) -> str:
         """
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Module of the compiled route policy used by the authentication gate."""
+from functools import lru_cache
+from typing import Dict, Iterable, Union
+
+PUBLIC = 'public'
+OPTIONAL = 'optional'
+REQUIRED = 'required'
+MODES = (PUBLIC, OPTIONAL, REQUIRED)
+
+# Trie key marking the end of a prefix rule (never a path character)
+_END = None
+
+
+class RoutePolicy:
+    """Authentication mode of request paths, compiled once.
+
+    Each rule maps a path to a mode: `public` (no authentication),
+    `optional` (credentials are checked only when sent) or `required`.
+    A rule ending with `*` covers every path starting with what precedes
+    it; other rules match the path exactly, trailing slash ignored.
+    Exact rules win over prefix rules, and the longest prefix wins.
+    Paths without a rule get `default`.
+
+    Exact rules live in a dict and prefix rules in a character trie, so
+    a lookup costs O(len(path)) however many rules there are.
+    """
+
+    def __init__(self, rules: Union[Dict[str, str], Iterable[str]] = (),
+                 default: str = REQUIRED):
+        """Compile rules: {path: mode}, or paths that are all public."""
+        if default not in MODES:
+            raise ValueError("unknown mode {}".format(default))
+        self.default = default
+        self._exact = {}
+        self._trie = {}
+        if not isinstance(rules, dict):
+            rules = {rule: PUBLIC for rule in rules}
+        for rule, mode in rules.items():
+            self.add(rule, mode)
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        """Path with a trailing slash."""
+        if path.endswith('/'):
+            return path
+        return path + '/'
+
+    def add(self, rule: str, mode: str = PUBLIC) -> None:
+        """Add (or replace) the rule of a path or `prefix*`."""
+        if mode not in MODES:
+            raise ValueError("unknown mode {}".format(mode))
+        if not rule.endswith('*'):
+            self._exact[self._normalize(rule)] = mode
+            return
+        node = self._trie
+        for char in rule[:-1]:
+            node = node.setdefault(char, {})
+        node[_END] = mode
+
+    def mode(self, path: str) -> str:
+        """Authentication mode of a request path."""
+        if path is None:
+            return self.default
+        path = self._normalize(path)
+        mode = self._exact.get(path)
+        if mode is not None:
+            return mode
+        node = self._trie
+        mode = node.get(_END, self.default)
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            mode = node.get(_END, mode)
+        return mode
+
+
+@lru_cache(maxsize=32)
+def compile_paths(excluded_paths: tuple) -> RoutePolicy:
+    """Policy making `excluded_paths` public, cached per list."""
+    return RoutePolicy(excluded_paths)
@@ -8,6 +8,7 @@ from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
 from api.v1.auth.auth import Auth
 from api.v1.auth.basic_auth import BasicAuth
+from api.v1.auth.route_policy import OPTIONAL, PUBLIC, RoutePolicy
 
 # Import SessionAuth if the file exists
 try:
@@ -48,6 +49,15 @@ elif auth_type == "session_db_auth" and SessionDBAuth is not None:
 else:
     auth = Auth()
 
+# Authentication mode of each route, compiled once; other routes require
+# authentication
+route_policy = RoutePolicy({
+    '/api/v1/status/': PUBLIC,
+    '/api/v1/unauthorized/': PUBLIC,
+    '/api/v1/forbidden/': PUBLIC,
+    '/api/v1/auth_session/login/': PUBLIC,
+})
+
 
 @app.before_request
 def before_request():
@@ -57,17 +67,16 @@ def before_request():
     if auth is None:
         return None
 
-    excluded_paths = [
-        '/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/',
-        '/api/v1/auth_session/login/'  # Exclude this route from auth
-    ]
-
-    if auth.require_auth(request.path, excluded_paths):
+    if auth.require_auth(request.path, route_policy):
+        optional = route_policy.mode(request.path) == OPTIONAL
         if auth.authorization_header(request) is None and auth.session_cookie(request) is None:
+            if optional:
+                request.current_user = None
+                return None
             abort(401)  # Unauthorized error
 
         request.current_user = auth.current_user(request)
-        if request.current_user is None:
+        if request.current_user is None and not optional:
             abort(403)  # Forbidden error
 
 
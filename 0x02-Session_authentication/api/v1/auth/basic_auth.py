@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """Module for Basic API authentication."""
 from api.v1.auth.auth import Auth
+from api.v1.auth.credential_cache import CredentialCache
 import base64
+import os
 from typing import TypeVar
 from models.user import User
 
@@ -9,6 +11,13 @@ from models.user import User
 class BasicAuth(Auth):
     """BasicAuth class inherits from Auth."""
 
+    def __init__(self) -> None:
+        """Initialize the cache of verified credentials."""
+        super().__init__()
+        self.credential_cache = CredentialCache(
+            int(os.getenv('BASIC_AUTH_CACHE_SIZE', '1024')),
+            float(os.getenv('BASIC_AUTH_CACHE_TTL', '300')))
+
     def extract_base64_authorization_header(
         self, authorization_header: str
     ) -> str:
@@ -129,6 +138,11 @@ class BasicAuth(Auth):
         if authorization_header is None:
             return None
 
+        # Repeated headers skip decoding, lookup and password check
+        user = self.credential_cache.get(authorization_header)
+        if user is not None:
+            return user
+
         base64_auth_header = self.extract_base64_authorization_header(
             authorization_header
         )
@@ -139,4 +153,7 @@ class BasicAuth(Auth):
                 decoded_auth_header
                 )
 
-        return self.user_object_from_credentials(user_email, user_pwd)
+        user = self.user_object_from_credentials(user_email, user_pwd)
+        if user is not None:
+            self.credential_cache.put(authorization_header, user)
+        return user
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Module of the verified-credential cache used by Basic authentication."""
+from collections import OrderedDict
+from typing import TypeVar
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from models.user import User
+
+
+class CredentialCache:
+    """Bounded LRU cache: Authorization header -> verified user ID.
+
+    Headers are only kept as a keyed digest (the key is random per
+    process), never in clear. Each entry also remembers the password hash
+    the credentials were checked against: a hit is only valid while the
+    user still exists with that same hash, so a password change or a
+    removal invalidates it without any explicit call.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """Initialize an empty cache."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, authorization_header: str) -> bytes:
+        """Keyed digest of an Authorization header."""
+        return hmac.new(self._key, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> TypeVar('User'):
+        """Return the user verified for this header, or None."""
+        if self.max_size <= 0:
+            return None
+        digest = self._digest(authorization_header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user_id, password, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+        user = User.get(user_id)
+        if user is None or user.password != password:
+            with self._lock:
+                self._entries.pop(digest, None)
+            return None
+        return user
+
+    def put(self, authorization_header: str, user: TypeVar('User')):
+        """Remember that this header authenticates `user`."""
+        if self.max_size <= 0:
+            return
+        digest = self._digest(authorization_header)
+        with self._lock:
+            self._entries[digest] = (user.id, user.password,
+                                     time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
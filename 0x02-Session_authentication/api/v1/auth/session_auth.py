@@ -41,6 +41,6 @@ class SessionAuth(Auth):
         user_id = self.user_id_for_session_id(session_id)
         if (request is None or session_id is None) or user_id is None:
             return False
-        if session_id in self.user_id_by_session_id:
-            del self.user_id_by_session_id[session_id]
+        # A single call: the sweeper may evict the session at any time
+        self.user_id_by_session_id.pop(session_id, None)
         return True
@@ -5,12 +5,17 @@ SessionDBAuth module that uses database storage for session information.
 
 from .session_exp_auth import SessionExpAuth
 from models.user_session import UserSession
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class SessionDBAuth(SessionExpAuth):
     """Session authentication with session data stored in the database."""
 
+    def __init__(self) -> None:
+        """Initialize and load the stored sessions once."""
+        super().__init__()
+        UserSession.load_from_file()
+
     def create_session(self, user_id=None):
         """Create and store a new session in the database."""
         session_id = super().create_session(user_id)
@@ -23,23 +28,32 @@ class SessionDBAuth(SessionExpAuth):
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
-        """Retrieve the User ID from the database for a given session_id."""
+        """Retrieve the User ID from the database for a given session_id.
+
+        The lookup goes through the in-memory `session_id` index of
+        UserSession, without reading the database file. Sessions written
+        by other workers are only seen with DB_SHARED=1 (`search` then
+        picks up their writes first).
+        """
         if session_id is None:
             return None
 
-        UserSession.load_from_file()  # Load sessions from the database
-        user_sessions = UserSession.all()
-        
-        for session in user_sessions.values():
-            if session.session_id == session_id:
-                # Check expiration if session_duration is set
-                if self.session_duration > 0:
-                    created_at = session.created_at
-                    expiration_time = created_at + timedelta(seconds=self.session_duration)
-                    if datetime.now() > expiration_time:
-                        return None
-                return session.user_id
-        return None
+        user_sessions = UserSession.search({'session_id': session_id})
+        if len(user_sessions) == 0:
+            return None
+
+        session = user_sessions[0]
+        # Check expiration if session_duration is set
+        if self.session_duration > 0:
+            expiration_time = session.created_at + \
+                timedelta(seconds=self.session_duration)
+            if datetime.utcnow() > expiration_time:
+                return None
+        return session.user_id
+
+    def session_stats(self) -> dict:
+        """Return the number of sessions stored in the database."""
+        return {'stored': UserSession.count()}
 
     def destroy_session(self, request=None):
         """Destroy a session in the database based on the Session ID."""
@@ -49,12 +63,9 @@ class SessionDBAuth(SessionExpAuth):
         if not session_id:
             return False
 
-        # Load the UserSession and delete it if it exists
-        UserSession.load_from_file()
-        user_sessions = UserSession.all()
-        
-        for session_key, session in user_sessions.items():
-            if session.session_id == session_id:
-                session.delete()
-                return True
-        return False
+        user_sessions = UserSession.search({'session_id': session_id})
+        if len(user_sessions) == 0:
+            return False
+        for session in user_sessions:
+            session.remove()
+        return True
@@ -5,6 +5,7 @@ Module implementing session authentication with expiration for the API.
 import os
 from datetime import datetime, timedelta
 from .session_auth import SessionAuth
+from .session_store import SessionStore
 
 class SessionExpAuth(SessionAuth):
     """Session authentication class that includes session expiration functionality."""
@@ -16,6 +17,8 @@ class SessionExpAuth(SessionAuth):
             self.session_duration = int(os.getenv('SESSION_DURATION', '0'))
         except ValueError:
             self.session_duration = 0
+        # Expired sessions are evicted in the background
+        self.user_id_by_session_id = SessionStore(self.session_duration)
 
     def create_session(self, user_id=None):
         """Create a session with an expiration time."""
@@ -30,10 +33,12 @@ class SessionExpAuth(SessionAuth):
 
     def user_id_for_session_id(self, session_id=None) -> str:
         """Retrieve the user ID for a session, checking for expiration."""
-        if session_id is None or session_id not in self.user_id_by_session_id:
+        if session_id is None:
+            return None
+        # A single lookup: the sweeper may evict the session at any time
+        session_info = self.user_id_by_session_id.get(session_id)
+        if session_info is None:
             return None
-        
-        session_info = self.user_id_by_session_id[session_id]
         if self.session_duration <= 0:
             return session_info.get('user_id')
         
@@ -44,3 +49,7 @@ class SessionExpAuth(SessionAuth):
         if datetime.now() > exp_time:
             return None
         return session_info.get('user_id')
+
+    def session_stats(self) -> dict:
+        """Return the live session count and eviction counters."""
+        return self.user_id_by_session_id.stats()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Module of the in-memory session store with expiry.
+"""
+from collections import deque
+import os
+import threading
+import time
+
+
+class SessionStore:
+    """Mapping of session ID -> session data whose entries expire.
+
+    Every session lives for the same duration, so insertion order is
+    expiry order: a FIFO queue of (expiry, session ID) is enough to find
+    expired sessions, and each one is evicted in O(1). A background
+    thread sweeps the queue; lookups also ignore expired entries.
+    A duration <= 0 means sessions never expire.
+    """
+
+    RATE_WINDOW = 60
+
+    def __init__(self, duration: int = 0, sweep_interval: float = None):
+        """Initialize an empty store."""
+        self.duration = duration
+        if sweep_interval is None:
+            sweep_interval = max(1, min(60, duration))
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._expires = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._evicted = 0
+        self._evictions = deque()
+        self._thread = None
+        self._pid = None
+
+    def __setitem__(self, session_id: str, value) -> None:
+        """Store a session, (re)starting its lifetime."""
+        with self._lock:
+            self._sessions[session_id] = value
+            if self.duration > 0:
+                expires = time.monotonic() + self.duration
+                self._expires[session_id] = expires
+                self._queue.append((expires, session_id))
+                self._start()
+
+    def __getitem__(self, session_id: str):
+        """Return a live session, KeyError if missing or expired."""
+        with self._lock:
+            expires = self._expires.get(session_id)
+            if expires is not None and expires <= time.monotonic():
+                raise KeyError(session_id)
+            return self._sessions[session_id]
+
+    def __delitem__(self, session_id: str) -> None:
+        """Remove a session."""
+        with self._lock:
+            del self._sessions[session_id]
+            self._expires.pop(session_id, None)
+
+    def pop(self, session_id: str, default=None):
+        """Remove a session and return its data, or `default`."""
+        with self._lock:
+            self._expires.pop(session_id, None)
+            return self._sessions.pop(session_id, default)
+
+    def __contains__(self, session_id) -> bool:
+        """True if the session exists and is not expired."""
+        try:
+            self[session_id]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        """Number of stored sessions (expired ones until swept)."""
+        return len(self._sessions)
+
+    def get(self, session_id: str, default=None):
+        """Return a live session or `default`."""
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def sweep(self) -> int:
+        """Evict every expired session, return how many were evicted."""
+        now = time.monotonic()
+        evicted = 0
+        with self._lock:
+            while len(self._queue) > 0 and self._queue[0][0] <= now:
+                expires, session_id = self._queue.popleft()
+                # Skip entries of sessions destroyed or renewed since
+                if self._expires.get(session_id) != expires:
+                    continue
+                del self._expires[session_id]
+                del self._sessions[session_id]
+                evicted += 1
+            self._evicted += evicted
+            self._evictions.append((now, evicted))
+            while self._evictions[0][0] < now - self.RATE_WINDOW:
+                self._evictions.popleft()
+        return evicted
+
+    def stats(self) -> dict:
+        """Live session count and eviction counters."""
+        with self._lock:
+            recent = sum(count for _, count in self._evictions)
+            return {
+                'live': len(self._sessions),
+                'evicted': self._evicted,
+                'evictions_per_second': recent / self.RATE_WINDOW,
+            }
+
+    def _start(self) -> None:
+        """Start the sweeper thread (once per process), lock held."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Background loop of the sweeper thread."""
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
@@ -21,8 +21,11 @@ def stats() -> str:
       - the number of each object type.
     """
     from models.user import User
+    from api.v1.app import auth
     stats = {}
     stats['users'] = User.count()
+    if hasattr(auth, 'session_stats'):
+        stats['sessions'] = auth.session_stats()
     return jsonify(stats)
 
 
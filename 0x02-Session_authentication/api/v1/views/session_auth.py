@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 """Session Authentication Views for the API."""
 
-from flask import jsonify, request, make_response
+from flask import jsonify, request
 from api.v1.views import app_views
+from api.v1.views.users import json_response
 from models.user import User
 from api.v1.app import auth
 
@@ -31,11 +32,10 @@ def login():
     # Create a session ID for the user
     session_id = auth.create_session(user[0].id)
 
-    # Get user JSON representation and send it back
-    user_json = user[0].to_json()
+    # Send back the cached JSON representation of the user
+    response = json_response(user[0].to_json_bytes())
 
     # Set the session cookie
-    response = make_response(jsonify(user_json))
     response.set_cookie(auth.SESSION_NAME, session_id)
 
     return response
@@ -2,17 +2,143 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Response, abort, jsonify, request, stream_with_context
+from models.base import TIMESTAMP_FORMAT
+from models.query import OPERATORS
 from models.user import User
+import json
+import os
+
+PAGE_LIMIT_MAX = 1000
+STREAM_PAGE_SIZE = 1000
+QUERY_FIELDS = ('id', 'email', 'first_name', 'last_name', 'created_at',
+                'updated_at')
+BATCH_LIMIT_MAX = 10000
+# PBKDF2 releases the GIL: batch passwords are hashed on this many threads
+BATCH_HASH_WORKERS = int(os.getenv('BATCH_HASH_WORKERS', '0')) or \
+    os.cpu_count() or 1
+
+def is_query_parameter(name: str) -> bool:
+    """ True for `order_by`, `offset` and `<field>[__<op>]` filters on a
+    known field; other parameters (e.g. a cache buster `_`) are ignored
+    """
+    return name in ('order_by', 'offset') or \
+        name.partition('__')[0] in QUERY_FIELDS
+
+def build_query(args):
+    """ Query from `field__op=value`, `order_by` and `offset` parameters
+
+    Raises ValueError on an unknown operator or a bad value.
+    """
+    query = User.query()
+    for name, value in args.items():
+        if not is_query_parameter(name):
+            continue
+        if name == 'order_by':
+            field = value.lstrip('-')
+            if field not in QUERY_FIELDS:
+                raise ValueError("can't order by {}".format(field))
+            query.order_by(field, descending=value.startswith('-'))
+            continue
+        if name == 'offset':
+            query.offset(int(value))
+            continue
+        field, _, op = name.partition('__')
+        op = op or 'eq'
+        if op not in OPERATORS:
+            raise ValueError("unknown filter {}".format(name))
+        values = value.split(',') if op == 'in' else [value]
+        if field in ('created_at', 'updated_at'):
+            if op == 'prefix':
+                raise ValueError("prefix can't filter {}, use ge and "
+                                 "lt".format(field))
+            values = [datetime.strptime(v, TIMESTAMP_FORMAT)
+                      for v in values]
+        query.where(field, op, values if op == 'in' else values[0])
+    return query
+
+def json_response(body: bytes, status: int = 200) -> Response:
+    """ Response with an already encoded JSON body
+    """
+    return Response(body, status=status, mimetype='application/json')
+
+def json_list(objs) -> bytes:
+    """ JSON list of objects, joined from their cached encodings
+    """
+    return b'[' + b','.join(obj.to_json_bytes() for obj in objs) + b']'
+
+def stream_users(cursor: str = None):
+    """ Generate the JSON list of users after `cursor`, page by page
+    """
+    yield b'['
+    separator = b''
+    while True:
+        users, cursor = User.page(STREAM_PAGE_SIZE, cursor)
+        for user in users:
+            yield separator + user.to_json_bytes()
+            separator = b','
+        if cursor is None:
+            break
+    yield b']'
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: page size (1 to 1000)
+      - cursor: `next_cursor` of the previous page
+      - stream: 1 to stream the list instead of building it in memory
+        (with cursor only)
+      - <field>__<op>=<value>: filter (op: eq (default), ne, lt, le, gt,
+        ge, prefix or in with comma separated values) on id, email,
+        first_name, last_name, created_at or updated_at (no prefix on
+        these two)
+      - order_by: field to sort on, `-field` for descending order
+      - offset: number of matching users to skip
+      Other parameters are ignored.
     Return:
       - list of all User objects JSON represented
+      - with limit/cursor: {"users": [...], "next_cursor": ID or null}
+      - with filters/order_by/offset: list of the matching User objects
+        (at most `limit`)
+      - 400 if a parameter is invalid, or stream is combined with
+        limit, filters, order_by or offset
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    querying = any(is_query_parameter(name) for name in request.args)
+    if request.args.get('stream') == '1':
+        if querying or limit is not None:
+            return jsonify({'error': "stream can't be combined with "
+                                     "filters or limit"}), 400
+        return Response(stream_with_context(stream_users(cursor)),
+                        mimetype='application/json')
+    if not querying and limit is None and cursor is None:
+        return json_response(json_list(User.all()))
+    try:
+        limit = int(limit) if limit is not None else PAGE_LIMIT_MAX
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > PAGE_LIMIT_MAX:
+        return jsonify({'error': "limit must be between 1 and {}".format(
+            PAGE_LIMIT_MAX)}), 400
+    if querying:
+        if cursor is not None:
+            return jsonify({'error': "cursor can't be combined with "
+                                     "filters, use offset"}), 400
+        try:
+            query = build_query(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if request.args.get('limit') is not None:
+            query.limit(limit)
+        return json_response(json_list(query))
+    users, next_cursor = User.page(limit, cursor)
+    return json_response(b'{"users":' + json_list(users) +
+                         b',"next_cursor":' +
+                         json.dumps(next_cursor).encode() + b'}')
 
 @app_views.route('/users/me', methods=['GET'], strict_slashes=False)
 def get_me() -> str:
@@ -23,7 +149,7 @@ def get_me() -> str:
     """
     if request.current_user is None:
         abort(404)
-    return jsonify(request.current_user.to_json())
+    return json_response(request.current_user.to_json_bytes())
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
 def view_one_user(user_id: str = None) -> str:
@@ -37,7 +163,7 @@ def view_one_user(user_id: str = None) -> str:
     if user_id == "me":
         if request.current_user is None:
             abort(404)  # If no authenticated user, return 404
-        return jsonify(request.current_user.to_json())  # Return authenticated user
+        return json_response(request.current_user.to_json_bytes())  # Return authenticated user
 
     if user_id is None:
         abort(404)  # Ensure that user_id is not None
@@ -46,7 +172,7 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)  # If user not found, return 404
-    return jsonify(user.to_json())
+    return json_response(user.to_json_bytes())
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
 def delete_user(user_id: str = None) -> str:
@@ -98,7 +224,7 @@ def create_user() -> str:
             user.first_name = rj.get("first_name")
             user.last_name = rj.get("last_name")
             user.save()  # Save the user to the database
-            return jsonify(user.to_json()), 201  # Return the created user in JSON format
+            return json_response(user.to_json_bytes(), 201)  # Return the created user in JSON format
         except Exception as e:
             error_msg = "Can't create User: {}".format(e)
     return jsonify({'error': error_msg}), 400  # Return an error if user creation fails
@@ -134,4 +260,114 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()  # Save the updated user to the database
-    return jsonify(user.to_json()), 200  # Return the updated user in JSON format
+    return json_response(user.to_json_bytes())  # Return the updated user in JSON format
+
+def batch_body(key: str):
+    """ List from a batch request body: a JSON list or {key: list}
+
+    Returns None if the body is not such a list (or is too long).
+    """
+    try:
+        rj = request.get_json()
+    except Exception:
+        rj = None
+    if isinstance(rj, dict):
+        rj = rj.get(key)
+    if not isinstance(rj, list) or len(rj) > BATCH_LIMIT_MAX:
+        return None
+    return rj
+
+def set_password(user: User, pwd: str) -> None:
+    """ Hash and set the password of a user
+    """
+    user.password = pwd
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body:
+      - list (or {"users": list}) of at most 10000 objects with the
+        parameters of POST /api/v1/users
+    Return:
+      - list of results in the same order: {"status": 201, "user": ...}
+        or {"status": 400, "error": ...}; valid users are saved at once
+      - 400 if the body is not such a list, or if the users can't be
+        saved (then none of them is)
+    """
+    items = batch_body('users')
+    if items is None:
+        return jsonify({'error': "Wrong format"}), 400
+    results = []
+    hashing = []
+    for rj in items:
+        error_msg = None
+        if not isinstance(rj, dict):
+            error_msg = "Wrong format"
+        elif rj.get("email", "") == "":
+            error_msg = "email missing"
+        elif rj.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is None:
+            try:
+                user = User()
+                user.email = rj.get("email")
+                user.first_name = rj.get("first_name")
+                user.last_name = rj.get("last_name")
+                hashing.append((len(results), user, rj.get("password")))
+                results.append(user)
+                continue
+            except Exception as e:
+                error_msg = "Can't create User: {}".format(e)
+        results.append(error_msg)
+    with ThreadPoolExecutor(BATCH_HASH_WORKERS) as pool:
+        futures = [pool.submit(set_password, user, pwd)
+                   for _, user, pwd in hashing]
+    users = []
+    for (i, user, _), future in zip(hashing, futures):
+        try:
+            future.result()
+            users.append(user)
+        except Exception as e:
+            results[i] = "Can't create User: {}".format(e)
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    fragments = []
+    for result in results:
+        if isinstance(result, User):
+            fragments.append(b'{"status":201,"user":' +
+                             result.to_json_bytes() + b'}')
+        else:
+            fragments.append(json.dumps({'status': 400,
+                                         'error': result}).encode())
+    return json_response(b'[' + b','.join(fragments) + b']')
+
+@app_views.route('/users/batch', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/batch
+    JSON body:
+      - list (or {"ids": list}) of at most 10000 User IDs
+    Return:
+      - list of results in the same order: {"id": ..., "status": 200}
+        or {"id": ..., "status": 404}; users are removed at once
+      - 400 if the body is not such a list, or if the users can't be
+        removed (then none of them is)
+    """
+    user_ids = batch_body('ids')
+    if user_ids is None:
+        return jsonify({'error': "Wrong format"}), 400
+    results = []
+    users = {}
+    for user_id in user_ids:
+        user = User.get(user_id) if isinstance(user_id, str) else None
+        if user is None or user_id in users:
+            results.append({'id': user_id, 'status': 404})
+        else:
+            users[user_id] = user
+            results.append({'id': user_id, 'status': 200})
+    try:
+        User.remove_many(users.values())
+    except Exception as e:
+        return jsonify({'error': "Can't delete Users: {}".format(e)}), 400
+    return jsonify(results), 200
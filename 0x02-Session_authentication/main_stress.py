@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+""" Main stress: many threads saving, searching and removing users
+
+Run it with any DB_* / MODEL_LAYOUT setting, e.g.
+    DB_JOURNAL=1 PASSWORD_HASH_ITERATIONS=1 ./main_stress.py
+"""
+import random
+import threading
+import time
+from models.base import FLUSHER
+from models.user import User
+
+THREADS = 16
+OPERATIONS = 200
+
+errors = []
+
+
+def worker(n):
+    """ Random mix of save/remove/search, then check what this thread
+    kept is still found once by email
+    """
+    try:
+        mine = []
+        for i in range(OPERATIONS):
+            r = random.random()
+            if r < 0.5:
+                user = User(email="stress-{}-{}@hbtn.io".format(n, i))
+                user.save()
+                mine.append(user)
+            elif r < 0.7 and len(mine) > 0:
+                mine.pop(random.randrange(len(mine))).remove()
+            elif r < 0.85:
+                User.search({'email': "stress-{}-{}@hbtn.io".format(n, i)})
+            else:
+                User.count()
+                User.page(10)
+        for user in mine:
+            found = User.search({'email': user.email})
+            assert [u.id for u in found] == [user.id], user.email
+    except Exception as e:
+        errors.append(e)
+        raise
+
+
+User.load_from_file()
+before = User.count()
+threads = [threading.Thread(target=worker, args=(n,))
+           for n in range(THREADS)]
+start = time.time()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.time() - start
+
+count = User.count()
+FLUSHER.flush()
+User.load_from_file()
+print("{} threads x {} operations in {:.2f}s".format(THREADS, OPERATIONS,
+                                                     elapsed))
+print("errors: {}".format(len(errors)))
+print("users added: {} in memory, {} reloaded".format(count - before,
+                                                      User.count() - before))
+
+User.remove_many(User.query().where('email', 'prefix', "stress-"))
+FLUSHER.flush()
@@ -1,40 +1,129 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import Callable, TypeVar, List, Iterable, Tuple
+from os import getenv, path
+from models import storage
+from models.index import HashIndex, SnapshotIndex
+from models.lock import ReadWriteLock
+from models.query import Query
+import bisect
+import calendar
 import json
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
 DATA = {}
 
+# One reader/writer lock per class guards DATA, INDEXES and JOURNAL_SIZE
+LOCKS = {}
+LOCKS_LOCK = threading.Lock()
+# Per class: records of mutations applied to DATA but not written yet, in
+# mutation order, and the lock of the thread writing them (the write lock
+# is released before the files are written)
+PENDING = {}
+IO_LOCKS = {}
+
+# Compact layout: models declared with `model_slots` have no per-instance
+# __dict__, only slots, and objects don't cache their JSON form
+COMPACT_MODELS = getenv("MODEL_LAYOUT", "dict") == "compact"
+SLOT_ATTRIBUTES = {}
+
+# Both timestamps (epoch seconds) share one int:
+# created_at << TIMESTAMP_BITS | updated_at (updated_at up to year 2514)
+TIMESTAMP_BITS = 34
+TIMESTAMP_MASK = (1 << TIMESTAMP_BITS) - 1
+
+# Journal mode: every save/remove appends one record to
+# `.db_<Class>.journal`, replayed on top of the snapshot at load time
+JOURNAL = getenv("DB_JOURNAL", "0").lower() in ("1", "true", "yes")
+JOURNAL_COMPACT_MIN = int(getenv("DB_JOURNAL_COMPACT_MIN", "1000"))
+JOURNAL_SIZE = {}
+
+# Secondary indexes per class: {attribute: HashIndex}, or None when they
+# must be rebuilt from DATA on next use
+INDEXES = {}
+# Sorted IDs per class for paging, or None when it must be rebuilt
+ORDERED_IDS = {}
+
+LOAD_PROGRESS_STEP = 10000
+
+# Snapshot format: "json" (.db_<Class>.json) or "binary" (.db_<Class>.bin,
+# memory-mapped at load time and decoded lazily)
+DB_FORMAT = getenv("DB_FORMAT", "json")
+
+# Write-behind mode: save/remove only update DATA; a background thread
+# persists dirty classes every DB_FLUSH_INTERVAL seconds, or once
+# DB_FLUSH_BATCH mutations are pending, with a single fsync
+WRITE_BEHIND = getenv("DB_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+FLUSH_INTERVAL = float(getenv("DB_FLUSH_INTERVAL", "1"))
+FLUSH_BATCH = int(getenv("DB_FLUSH_BATCH", "1000"))
+
+# Shared mode: several processes use the same files. Reads first check
+# (at most every DB_SYNC_INTERVAL seconds) whether the files changed:
+# new journal records are tailed, a new snapshot is reloaded
+SHARED = getenv("DB_SHARED", "0").lower() in ("1", "true", "yes")
+SYNC_INTERVAL = float(getenv("DB_SYNC_INTERVAL", "0"))
+# A snapshot rewritten from this process' DATA would drop what the others
+# saved since: shared mode always appends to the journal
+JOURNAL = JOURNAL or SHARED
+# Per class: snapshot signature and journal offset DATA is in sync with
+FILE_STATE = {}
+
+
+def model_slots(*attributes: str) -> tuple:
+    """ __slots__ of a model: its attributes in compact layout,
+    a regular __dict__ otherwise
+    """
+    if COMPACT_MODELS:
+        return attributes
+    return ('__dict__',)
+
 
 class Base():
     """ Base class
     """
+    __slots__ = ('id', '_timestamps') + \
+        (() if COMPACT_MODELS else ('_json_cache',))
+    indexed_attributes = ()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
+        self._timestamps = 0
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
-        if kwargs.get('created_at') is not None:
+        if type(kwargs.get('created_at')) is int:
+            self._created_at = kwargs.get('created_at')
+        elif kwargs.get('created_at') is not None:
             self.created_at = datetime.strptime(kwargs.get('created_at'),
                                                 TIMESTAMP_FORMAT)
         else:
             self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
+        if type(kwargs.get('updated_at')) is int:
+            self._updated_at = kwargs.get('updated_at')
+        elif kwargs.get('updated_at') is not None:
             self.updated_at = datetime.strptime(kwargs.get('updated_at'),
                                                 TIMESTAMP_FORMAT)
         else:
             self.updated_at = datetime.utcnow()
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, dropping the cached JSON form
+        """
+        object.__setattr__(self, name, value)
+        if not COMPACT_MODELS and name != '_json_cache':
+            object.__setattr__(self, '_json_cache', None)
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -44,11 +133,121 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @property
+    def _created_at(self) -> int:
+        """ Creation date in epoch seconds
+        """
+        return self._timestamps >> TIMESTAMP_BITS
+
+    @_created_at.setter
+    def _created_at(self, value: int):
+        """ Setter of the creation date in epoch seconds
+        """
+        self._timestamps = (value << TIMESTAMP_BITS) | \
+            (self._timestamps & TIMESTAMP_MASK)
+
+    @property
+    def _updated_at(self) -> int:
+        """ Last update date in epoch seconds
+        """
+        return self._timestamps & TIMESTAMP_MASK
+
+    @_updated_at.setter
+    def _updated_at(self, value: int):
+        """ Setter of the last update date in epoch seconds
+        """
+        if value < 0 or value > TIMESTAMP_MASK:
+            raise ValueError("updated_at out of range: {}".format(value))
+        self._timestamps = \
+            (self._timestamps >> TIMESTAMP_BITS << TIMESTAMP_BITS) | value
+
+    @property
+    def created_at(self) -> datetime:
+        """ Creation date (stored as epoch seconds)
+        """
+        return EPOCH + timedelta(seconds=self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation date
+        """
+        self._created_at = calendar.timegm(value.utctimetuple())
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update date (stored as epoch seconds)
+        """
+        return EPOCH + timedelta(seconds=self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update date
+        """
+        self._updated_at = calendar.timegm(value.utctimetuple())
+
+    @classmethod
+    def _slot_attributes(cls) -> tuple:
+        """ Model attributes stored in slots declared by subclasses
+        """
+        if cls not in SLOT_ATTRIBUTES:
+            names = []
+            for klass in reversed(cls.__mro__):
+                if klass is Base or klass is object:
+                    continue
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in ('__dict__', '__weakref__'):
+                        names.append(name)
+            SLOT_ATTRIBUTES[cls] = tuple(names)
+        return SLOT_ATTRIBUTES[cls]
+
+    def _attributes(self) -> Iterable[tuple]:
+        """ Iterate over (name, value) of every stored attribute
+        """
+        yield 'id', self.id
+        yield 'created_at', self.created_at
+        yield 'updated_at', self.updated_at
+        for name in self.__class__._slot_attributes():
+            if hasattr(self, name):
+                yield name, getattr(self, name)
+        if hasattr(self, '__dict__'):
+            yield from self.__dict__.items()
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+
+        The public form is cached until an attribute is set (except in
+        compact layout).
+        """
+        if not for_serialization:
+            return dict(self._cached_json()[0])
+        return self._json(True)
+
+    def to_json_bytes(self) -> bytes:
+        """ Public JSON form of the object, encoded (cached like to_json)
+        """
+        result, encoded = self._cached_json()
+        if encoded is None:
+            encoded = json.dumps(result, separators=(',', ':')).encode()
+            if not COMPACT_MODELS:
+                self._json_cache = (result, encoded)
+        return encoded
+
+    def _cached_json(self) -> tuple:
+        """ (public JSON dictionary, its encoding or None), from the cache
+        """
+        if COMPACT_MODELS:
+            return (self._json(False), None)
+        cache = self._json_cache
+        if cache is None:
+            cache = (self._json(False), None)
+            self._json_cache = cache
+        return cache
+
+    def _json(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary of the object
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +256,484 @@ class Base():
                 result[key] = value
         return result
 
+    def to_binary(self) -> bytes:
+        """ Encode the object as a binary snapshot payload
+        """
+        result = self.to_json(True)
+        result['created_at'] = self._created_at
+        result['updated_at'] = self._updated_at
+        return json.dumps(result).encode()
+
+    @classmethod
+    def _snapshot_path(cls) -> str:
+        """ Path of the snapshot file of the class
+        """
+        if DB_FORMAT == "binary":
+            return ".db_{}.bin".format(cls.__name__)
+        return ".db_{}.json".format(cls.__name__)
+
+    @classmethod
+    def load_from_file(cls, progress: Callable[[int], None] = None):
+        """ Load all objects from file, then replay the journal
+
+        The file is streamed: objects are built one at a time. `progress`
+        is called with the number of objects loaded so far every
+        LOAD_PROGRESS_STEP objects, and once at the end.
+
+        A binary snapshot is memory-mapped instead: objects are decoded
+        on first access.
+        """
+        if WRITE_BEHIND:
+            FLUSHER.flush()
+        with cls._io_lock(), cls._lock().write(), \
+                cls._file_lock(shared=True):
+            cls._load(progress)
+            for record in PENDING.get(cls.__name__, []):
+                cls._replay(record)
+
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def _load(cls, progress: Callable[[int], None] = None):
+        """ Body of load_from_file (write lock held)
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
+        file_path = cls._snapshot_path()
+        state = {'snapshot': storage.signature(file_path), 'offset': 0,
+                 'checked': time.monotonic()}
         DATA[s_class] = {}
-        if not path.exists(file_path):
+        INDEXES[s_class] = None
+        ORDERED_IDS[s_class] = None
+        JOURNAL_SIZE[s_class] = 0
+        if DB_FORMAT == "binary" and path.exists(file_path):
+            DATA[s_class] = storage.BinaryTable(
+                file_path, lambda payload: cls(**json.loads(payload)))
+        elif path.exists(file_path):
+            for obj_id, obj_json in storage.iter_snapshot(file_path):
+                obj = cls(**obj_json)
+                DATA[s_class][obj.id] = obj
+                if progress is not None and \
+                        len(DATA[s_class]) % LOAD_PROGRESS_STEP == 0:
+                    progress(len(DATA[s_class]))
+
+        FILE_STATE[s_class] = state
+        cls._tail()
+        if progress is not None:
+            progress(len(DATA[s_class]))
+
+    @classmethod
+    def refresh(cls):
+        """ Pick up changes written to the files by other processes
+
+        Costs a couple of stat calls when nothing changed. New journal
+        records are replayed; a new snapshot (compaction) is reloaded.
+        """
+        change = cls._changes()
+        if change == 'reload':
+            cls.load_from_file()
+        elif change == 'tail':
+            with cls._io_lock(), cls._lock().write():
+                cls._tail()
+
+    @classmethod
+    def _sync(cls):
+        """ In shared mode, refresh before reading when due
+        """
+        if not SHARED:
             return
+        state = FILE_STATE.get(cls.__name__)
+        if state is None or \
+                time.monotonic() - state['checked'] >= SYNC_INTERVAL:
+            cls.refresh()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _changes(cls) -> str:
+        """ How DATA lags behind the files: 'reload', 'tail' or None
+        """
+        state = FILE_STATE.get(cls.__name__)
+        if state is None or \
+                storage.signature(cls._snapshot_path()) != state['snapshot']:
+            return 'reload'
+        state['checked'] = time.monotonic()
+        size = storage.file_size(cls._journal_path())
+        if size < state['offset']:
+            return 'reload'
+        if size > state['offset']:
+            return 'tail'
+        return None
 
     @classmethod
-    def save_to_file(cls):
-        """ Save all objects to file
+    def _catch_up(cls, records: list):
+        """ Before writing in shared mode, apply what other processes
+        wrote; `records` being written and those still pending (already
+        in DATA) are re-applied after a reload
+
+        Write lock and exclusive file lock held.
+        """
+        change = cls._changes()
+        if change == 'reload':
+            cls._load()
+            for record in records + PENDING.get(cls.__name__, []):
+                cls._replay(record)
+        elif change == 'tail':
+            cls._tail()
+
+    @classmethod
+    def _tail(cls):
+        """ Replay journal records past the known offset (write lock held)
+        """
+        s_class = cls.__name__
+        state = FILE_STATE[s_class]
+        for record, offset in storage.iter_records(cls._journal_path(),
+                                                   state['offset']):
+            cls._replay(record)
+            JOURNAL_SIZE[s_class] += 1
+            state['offset'] = offset
+
+    @classmethod
+    def save_to_file(cls, sync: bool = False):
+        """ Save all objects to file and compact the journal
+
+        Pending records are part of the snapshot. In shared mode, journal
+        records of other processes are applied first.
+        """
+        with cls._io_lock(), cls._file_lock():
+            with cls._lock().write():
+                records = PENDING.pop(cls.__name__, [])
+                if SHARED:
+                    cls._catch_up(records)
+            cls._save_snapshot(sync)
+
+    @classmethod
+    def _save_snapshot(cls, sync: bool = False):
+        """ Write the snapshot and drop the journal (I/O and file locks
+        held)
+
+        Objects are listed under the read lock, then encoded and written
+        without it: neither readers nor writers wait for the file.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        file_path = cls._snapshot_path()
+        with cls._lock().read():
+            if DB_FORMAT == "binary":
+                items = cls._payloads()
+            else:
+                items = list(DATA[s_class].items())
+        if DB_FORMAT == "binary":
+            storage.write_binary(file_path, (
+                (obj_id, item if isinstance(item, bytes) else
+                 item.to_binary()) for obj_id, item in items), sync,
+                cls.indexed_attributes)
+        else:
+            storage.write_snapshot(file_path, (
+                (obj_id, obj.to_json(True)) for obj_id, obj in items), sync)
+        storage.truncate(cls._journal_path())
+        with cls._lock().write():
+            JOURNAL_SIZE[s_class] = 0
+            FILE_STATE[s_class] = {'snapshot': storage.signature(file_path),
+                                   'offset': 0, 'checked': time.monotonic()}
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _file_lock(cls, shared: bool = False):
+        """ Lock of the class files across processes, in shared mode
+        """
+        if not SHARED:
+            return nullcontext()
+        return storage.file_lock(".db_{}.lock".format(cls.__name__), shared)
+
+    @classmethod
+    def _io_lock(cls) -> threading.RLock:
+        """ Lock of the thread writing the class files
+        """
+        s_class = cls.__name__
+        if s_class not in IO_LOCKS:
+            with LOCKS_LOCK:
+                if s_class not in IO_LOCKS:
+                    IO_LOCKS[s_class] = threading.RLock()
+        return IO_LOCKS[s_class]
+
+    @classmethod
+    def _lock(cls) -> ReadWriteLock:
+        """ Reader/writer lock of the class
+        """
+        s_class = cls.__name__
+        if s_class not in LOCKS:
+            with LOCKS_LOCK:
+                if s_class not in LOCKS:
+                    LOCKS[s_class] = ReadWriteLock()
+        return LOCKS[s_class]
+
+    @classmethod
+    def _payloads(cls) -> List[tuple]:
+        """ (id, object) of every object, or (id, binary payload) for
+        records of a mapped snapshot that were never decoded (copied as is)
+        """
+        table = DATA[cls.__name__]
+        items = []
+        for obj_id in list(table):
+            payload = None
+            if isinstance(table, storage.BinaryTable):
+                payload = table.payload(obj_id)
+            items.append((obj_id, payload if payload is not None
+                          else table[obj_id]))
+        return items
+
+    @classmethod
+    def _journal_path(cls) -> str:
+        """ Path of the journal file of the class
+        """
+        return ".db_{}.journal".format(cls.__name__)
+
+    @classmethod
+    def _replay(cls, record: dict):
+        """ Apply one journal record to DATA
+        """
+        s_class = cls.__name__
+        if record.get('op') == 'save':
+            obj = cls(**record['obj'])
+            current = DATA[s_class].get(obj.id)
+            if current is not None and \
+                    current._updated_at > obj._updated_at:
+                return
+            DATA[s_class][obj.id] = obj
+            cls._index(obj)
+        elif record.get('op') == 'remove':
+            DATA[s_class].pop(record.get('id'), None)
+            cls._unindex(record.get('id'))
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Indexes of the class, built from DATA if needed
+
+        A binary snapshot holding the attribute's values is not decoded.
+        """
+        s_class = cls.__name__
+        if INDEXES.get(s_class) is None:
+            indexes = {}
+            table = DATA[s_class]
+            for attribute in cls.indexed_attributes:
+                if isinstance(table, storage.BinaryTable) and \
+                        table.has_values(attribute):
+                    indexes[attribute] = SnapshotIndex(attribute, table)
+                    continue
+                indexes[attribute] = HashIndex(attribute)
+                for obj in DATA[s_class].values():
+                    indexes[attribute].add(obj)
+            INDEXES[s_class] = indexes
+        return INDEXES[s_class]
+
+    @classmethod
+    def _ordered_ids(cls) -> List[str]:
+        """ Sorted IDs of the class, built from DATA if needed
+        """
+        s_class = cls.__name__
+        if ORDERED_IDS.get(s_class) is None:
+            ORDERED_IDS[s_class] = sorted(DATA[s_class])
+        return ORDERED_IDS[s_class]
+
+    @classmethod
+    def _index(cls, obj: TypeVar('Base')):
+        """ Update indexes and sorted IDs for a saved object
+        """
+        ids = ORDERED_IDS.get(cls.__name__)
+        if ids is not None:
+            i = bisect.bisect_left(ids, obj.id)
+            if i == len(ids) or ids[i] != obj.id:
+                ids.insert(i, obj.id)
+        if INDEXES.get(cls.__name__) is None:
+            return
+        for index in INDEXES[cls.__name__].values():
+            index.add(obj)
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """ Drop a removed object from indexes and sorted IDs
+        """
+        ids = ORDERED_IDS.get(cls.__name__)
+        if ids is not None:
+            i = bisect.bisect_left(ids, obj_id)
+            if i < len(ids) and ids[i] == obj_id:
+                del ids[i]
+        if INDEXES.get(cls.__name__) is None:
+            return
+        for index in INDEXES[cls.__name__].values():
+            index.discard(obj_id)
+
+    @classmethod
+    def _persist(cls, records: list):
+        """ Queue records for `_flush`, or hand them to the write-behind
+        flusher
+
+        Called with the write lock held, so records are queued in the
+        order mutations were applied.
+        """
+        if WRITE_BEHIND:
+            FLUSHER.add(cls, records)
+        else:
+            PENDING.setdefault(cls.__name__, []).extend(records)
+
+    @classmethod
+    def _flush(cls):
+        """ Write the queued records, once the write lock is released
+
+        The thread holding the I/O lock writes every record queued so
+        far, in order: concurrent saves share one write, and a save
+        returns once its records are written.
+        """
+        if WRITE_BEHIND:
+            return
+        s_class = cls.__name__
+        with cls._io_lock():
+            with cls._lock().write():
+                records = PENDING.pop(s_class, [])
+            if len(records) == 0:
+                return
+            try:
+                cls._write(records)
+            except Exception:
+                # Queued again: savers waiting for them retry the write
+                with cls._lock().write():
+                    PENDING[s_class] = records + PENDING.get(s_class, [])
+                raise
+
+    @classmethod
+    def _write(cls, records: list, sync: bool = False):
+        """ Append records to the journal or rewrite the file
+
+        The journal is folded into a new snapshot once it holds more
+        records than objects, so appends stay O(1) amortized. Only
+        shared mode appends with the write lock held (so reads never
+        replay this process' own records), but it still syncs without.
+        """
+        s_class = cls.__name__
+        journal_path = cls._journal_path()
+        with cls._io_lock(), cls._file_lock():
+            if not JOURNAL:
+                cls._save_snapshot(sync)
+                return
+            with cls._lock().write():
+                if SHARED:
+                    cls._catch_up(records)
+                    storage.append_records(journal_path, records)
+                    FILE_STATE[s_class]['offset'] = \
+                        storage.file_size(journal_path)
+                JOURNAL_SIZE[s_class] = JOURNAL_SIZE.get(s_class, 0) + \
+                    len(records)
+                compact = JOURNAL_SIZE[s_class] > max(JOURNAL_COMPACT_MIN,
+                                                      len(DATA[s_class]))
+            if not SHARED:
+                storage.append_records(journal_path, records, sync)
+                # Tails (I/O lock held) must not replay these records
+                if s_class in FILE_STATE:
+                    FILE_STATE[s_class]['offset'] = \
+                        storage.file_size(journal_path)
+            elif sync:
+                storage.sync_file(journal_path)
+            if compact:
+                cls._save_snapshot(sync)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__._lock().write():
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            self.__class__._index(self)
+            self.__class__._persist([{'op': 'save',
+                                      'obj': self.to_json(True)}])
+        self.__class__._flush()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with self.__class__._lock().write():
+            if DATA[s_class].get(self.id) is not None:
+                del DATA[s_class][self.id]
+                self.__class__._unindex(self.id)
+                self.__class__._persist([{'op': 'remove', 'id': self.id}])
+        self.__class__._flush()
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save many objects of the class, persisted at once
+
+        One snapshot rewrite, journal append or flusher hand-off for the
+        whole batch instead of one per object. If they can't be written,
+        DATA is restored as it was before the call and the error raised.
+        """
+        s_class = cls.__name__
+        objs = list(objs)
+        with cls._lock().write():
+            now = datetime.utcnow()
+            for obj in objs:
+                obj.updated_at = now
+            records = [{'op': 'save', 'obj': obj.to_json(True)}
+                       for obj in objs]
+            previous = {obj.id: DATA[s_class].get(obj.id) for obj in objs}
+            for obj in objs:
+                DATA[s_class][obj.id] = obj
+                cls._index(obj)
+            if len(records) > 0:
+                cls._persist(records)
+        try:
+            cls._flush()
+        except Exception:
+            cls._rollback(previous, records)
+            raise
+
+    @classmethod
+    def _rollback(cls, previous: dict, records: list):
+        """ Undo a save_many/remove_many that couldn't be written:
+        restore the `previous` objects by ID (None if absent) and
+        unqueue `records`
+        """
+        s_class = cls.__name__
+        with cls._lock().write():
+            mine = set(id(record) for record in records)
+            PENDING[s_class] = [record for record in PENDING.get(s_class, [])
+                                if id(record) not in mine]
+            for obj_id, obj in previous.items():
+                if obj is None:
+                    DATA[s_class].pop(obj_id, None)
+                    cls._unindex(obj_id)
+                else:
+                    DATA[s_class][obj_id] = obj
+                    cls._index(obj)
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Remove many objects of the class, persisted at once
+
+        If they can't be written, the removed objects are put back in
+        DATA and the error raised.
+        """
+        s_class = cls.__name__
+        with cls._lock().write():
+            records = []
+            previous = {}
+            for obj in objs:
+                current = DATA[s_class].get(obj.id)
+                if current is not None:
+                    del DATA[s_class][obj.id]
+                    cls._unindex(obj.id)
+                    previous[obj.id] = current
+                    records.append({'op': 'remove', 'id': obj.id})
+            if len(records) > 0:
+                cls._persist(records)
+        try:
+            cls._flush()
+        except Exception:
+            cls._rollback(previous, records)
+            raise
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        cls._sync()
+        with cls._lock().read():
+            return len(DATA[s_class].keys())
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -119,11 +746,53 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        cls._sync()
+        with cls._lock().read():
+            return DATA[s_class].get(id)
+
+    @classmethod
+    def query(cls) -> Query:
+        """ New query on all objects, see models.query.Query
+        """
+        return Query(cls)
+
+    @classmethod
+    def _fetch(cls, ids: Iterable[str]) -> List[TypeVar('Base')]:
+        """ Objects of these IDs that still exist
+        """
+        s_class = cls.__name__
+        with cls._lock().read():
+            table = DATA[s_class]
+            return [table[obj_id] for obj_id in ids if obj_id in table]
+
+    @classmethod
+    def page(cls, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Up to `limit` objects ordered by ID, after the `cursor` ID
+
+        Returns the objects and the cursor of the next page (None after
+        the last page). Pages stay consistent while objects are added or
+        removed: the cursor is an ID, not a position.
+        """
+        s_class = cls.__name__
+        cls._sync()
+        with cls._lock().read():
+            ids = cls._ordered_ids()
+            start = 0
+            if cursor is not None:
+                start = bisect.bisect_right(ids, cursor)
+            page_ids = ids[start:start + limit]
+            objs = [DATA[s_class][obj_id] for obj_id in page_ids]
+            if start + limit >= len(ids):
+                return objs, None
+            return objs, page_ids[-1]
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        When an attribute of the query is indexed, only the objects
+        listed by the most selective index are checked.
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +802,25 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        cls._sync()
+        with cls._lock().read():
+            candidates = None
+            indexes = cls._indexes() if len(attributes) > 0 else {}
+            for k, v in attributes.items():
+                if k not in indexes:
+                    continue
+                ids = indexes[k].lookup(v)
+                if ids is not None and (candidates is None or
+                                        len(ids) < len(candidates)):
+                    candidates = ids
+
+            if candidates is None:
+                return list(filter(_search, DATA[s_class].values()))
+            objs = [DATA[s_class][obj_id] for obj_id in candidates
+                    if obj_id in DATA[s_class]]
+            return list(filter(_search, objs))
+
+
+FLUSHER = storage.Flusher(lambda cls, records: cls._write(records, True),
+                          FLUSH_INTERVAL, FLUSH_BATCH)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+""" Index module: secondary hash indexes on model attributes
+"""
+from typing import Set, TypeVar
+
+
+class HashIndex():
+    """ Equality index mapping one attribute value to object IDs
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on `attribute`
+        """
+        self.attribute = attribute
+        self._ids = {}
+        self._values = {}
+        self._unhashable = set()
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object
+        """
+        self.discard(obj.id)
+        value = getattr(obj, self.attribute, None)
+        try:
+            self._ids.setdefault(value, set()).add(obj.id)
+        except TypeError:
+            self._unhashable.add(obj.id)
+            return
+        self._values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object ID from the index
+        """
+        self._unhashable.discard(obj_id)
+        if obj_id not in self._values:
+            return
+        value = self._values.pop(obj_id)
+        ids = self._ids[value]
+        ids.discard(obj_id)
+        if len(ids) == 0:
+            del self._ids[value]
+
+    def lookup(self, value) -> Set[str]:
+        """ IDs of objects whose attribute may equal `value`
+
+        Returns None when the value can't be answered by the index.
+        """
+        try:
+            ids = self._ids.get(value, set())
+        except TypeError:
+            return None
+        if len(self._unhashable) > 0:
+            return ids | self._unhashable
+        return ids
+
+
+class SnapshotIndex(HashIndex):
+    """ Index of a class loaded from a binary snapshot
+
+    Records of the snapshot are looked up in the values written with it
+    (storage.BinaryTable.value_ids), so building the index decodes
+    nothing; objects decoded, saved or removed since are indexed in
+    memory like in a HashIndex.
+    """
+
+    def __init__(self, attribute: str, table):
+        """ Initialize the index of `attribute` on a BinaryTable
+        """
+        super().__init__(attribute)
+        self._table = table
+        objects, removed = table.overlay()
+        self._changed = set(removed)
+        for obj in list(objects.values()):
+            self.add(obj)
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object
+        """
+        self._changed.add(obj.id)
+        super().add(obj)
+
+    def discard(self, obj_id: str):
+        """ Remove an object ID from the index
+        """
+        self._changed.add(obj_id)
+        super().discard(obj_id)
+
+    def lookup(self, value) -> Set[str]:
+        """ IDs of objects whose attribute may equal `value`
+
+        Returns None when the value can't be answered by the index.
+        """
+        ids = super().lookup(value)
+        if ids is None:
+            return None
+        return ids | set(obj_id for obj_id in
+                         self._table.value_ids(self.attribute, value)
+                         if obj_id not in self._changed)
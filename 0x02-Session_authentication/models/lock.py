@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+""" Lock module: reader/writer lock guarding the objects of a class
+"""
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock():
+    """ Many concurrent readers or one writer
+
+    Waiting writers take precedence over new readers, so a steady flow of
+    reads can't starve them. Both sides are reentrant, and the writer may
+    also read (e.g. `_catch_up` replaying records while saving).
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock for reading
+        """
+        me = threading.get_ident()
+        depth = getattr(self._local, 'reads', 0)
+        if depth == 0 and self._writer != me:
+            with self._cond:
+                while self._writer is not None or self._waiting_writers > 0:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.reads = depth + 1
+        try:
+            yield
+        finally:
+            self._local.reads = depth
+            if depth == 0 and self._writer != me:
+                with self._cond:
+                    self._readers -= 1
+                    if self._readers == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock for writing
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers > 0:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writes -= 1
+                if self._writes == 0:
+                    self._writer = None
+                    self._cond.notify_all()
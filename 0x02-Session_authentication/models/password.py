@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+""" Password module: pluggable password hashing schemes
+"""
+from os import getenv
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+class SHA256Hasher():
+    """ Legacy scheme: unsalted SHA256 hex digest
+    """
+    name = "sha256"
+
+    def hash(self, pwd: str) -> str:
+        """ Hash a password
+        """
+        return hashlib.sha256(pwd.encode()).hexdigest().lower()
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Check a password against a hash
+        """
+        return hmac.compare_digest(self.hash(pwd), hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """ Nothing to tune in this scheme
+        """
+        return False
+
+
+class PBKDF2Hasher():
+    """ PBKDF2-HMAC-SHA256 with a per-password salt
+
+    Hashes are stored as `$pbkdf2-sha256$<iterations>$<salt>$<hash>`.
+    Unless fixed, the iteration count is calibrated on first use so one
+    hash takes about `target_ms` on this host: PROBE_ITERATIONS times the
+    closest power of 2.
+    """
+    name = "pbkdf2-sha256"
+    PROBE_ITERATIONS = 10000
+
+    def __init__(self, iterations: int = None, target_ms: float = 100):
+        """ Initialize the scheme
+        """
+        self._iterations = iterations
+        self._fixed = iterations is not None
+        self.target_ms = target_ms
+        self._lock = threading.Lock()
+
+    @property
+    def iterations(self) -> int:
+        """ Iteration count of new hashes
+        """
+        if self._iterations is None:
+            with self._lock:
+                if self._iterations is None:
+                    self._iterations = self.calibrate()
+        return self._iterations
+
+    def calibrate(self) -> int:
+        """ Iteration count closest to the target duration, of the form
+        PROBE_ITERATIONS * 2**k
+        """
+        start = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"calibration", b"salt",
+                            self.PROBE_ITERATIONS)
+        elapsed_ms = max((time.perf_counter() - start) * 1000, 1e-3)
+        wanted = self.PROBE_ITERATIONS * self.target_ms / elapsed_ms
+        iterations = self.PROBE_ITERATIONS
+        while iterations * 1.5 <= wanted:
+            iterations *= 2
+        return iterations
+
+    def hash(self, pwd: str) -> str:
+        """ Hash a password with the current iteration count
+        """
+        salt = os.urandom(16)
+        iterations = self.iterations
+        digest = hashlib.pbkdf2_hmac("sha256", pwd.encode(), salt,
+                                     iterations)
+        return "${}${}${}${}".format(self.name, iterations, salt.hex(),
+                                     digest.hex())
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Check a password against a hash
+        """
+        try:
+            _, _, iterations, salt, digest = hashed.split("$")
+            expected = hashlib.pbkdf2_hmac("sha256", pwd.encode(),
+                                           bytes.fromhex(salt),
+                                           int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected.hex(), digest)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """ True if the hash was made with another iteration count
+
+        A calibrated count tolerates a factor of 2, so timing noise
+        between restarts doesn't rehash every password.
+        """
+        try:
+            iterations = int(hashed.split("$")[2])
+        except (IndexError, ValueError):
+            return True
+        if self._fixed:
+            return iterations != self.iterations
+        return iterations * 2 < self.iterations or \
+            iterations > self.iterations * 2
+
+
+class PasswordHasher():
+    """ Hashes with the default scheme, verifies any known scheme
+    """
+
+    def __init__(self, default: str, schemes: list):
+        """ Initialize with the available schemes
+        """
+        self.schemes = {scheme.name: scheme for scheme in schemes}
+        self.default = self.schemes[default]
+
+    def identify(self, hashed: str):
+        """ Scheme of a stored hash (legacy hashes have no prefix)
+        """
+        if hashed.startswith("$"):
+            return self.schemes.get(hashed.split("$")[1])
+        return self.schemes.get(SHA256Hasher.name)
+
+    def hash(self, pwd: str) -> str:
+        """ Hash a password with the default scheme
+        """
+        return self.default.hash(pwd)
+
+    def verify(self, pwd: str, hashed: str) -> bool:
+        """ Check a password against a hash of any known scheme
+        """
+        scheme = self.identify(hashed)
+        return scheme is not None and scheme.verify(pwd, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """ True if the hash doesn't use the default scheme and cost
+        """
+        scheme = self.identify(hashed)
+        return scheme is not self.default or scheme.needs_rehash(hashed)
+
+
+HASHER = PasswordHasher(
+    getenv("PASSWORD_HASH_SCHEME", PBKDF2Hasher.name),
+    [SHA256Hasher(),
+     PBKDF2Hasher(int(getenv("PASSWORD_HASH_ITERATIONS", "0")) or None,
+                  float(getenv("PASSWORD_HASH_TARGET_MS", "100")))])
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+""" Query module: predicates, sorting and limits over model objects
+"""
+from typing import Iterator, List, TypeVar
+import bisect
+import operator
+
+
+def _prefix(value, prefix) -> bool:
+    """ True if `value` is a string starting with `prefix`
+    """
+    return isinstance(value, str) and value.startswith(prefix)
+
+
+def _in(value, values) -> bool:
+    """ True if `value` is one of `values`
+    """
+    return value in values
+
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'prefix': _prefix,
+    'in': _in,
+}
+
+FETCH_SIZE = 1000
+
+
+class Query():
+    """ Lazy query on the objects of a model class
+
+    Build it with `Model.query()` and chain `where`, `order_by`, `limit`
+    and `offset`; objects are only looked up while iterating, in chunks,
+    without holding the class lock between chunks.
+
+    The planner answers `eq`/`in` predicates on indexed attributes from
+    their hash index, and `id` ranges/prefixes from the sorted IDs;
+    otherwise every object is scanned. Results are ordered by ID unless
+    `order_by` names another attribute (then all matches are sorted
+    before the first one is returned, with None values last).
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize a query matching every object of `cls`
+        """
+        self._cls = cls
+        self._predicates = []
+        self._order = 'id'
+        self._descending = False
+        self._limit = None
+        self._offset = 0
+
+    def where(self, attribute: str, op: str, value) -> 'Query':
+        """ Keep objects whose `attribute` matches `value` with `op`
+
+        `op` is one of eq, ne, lt, le, gt, ge, prefix or in.
+        """
+        if op not in OPERATORS:
+            raise ValueError("unknown operator {}".format(op))
+        if op == 'in':
+            value = list(value)
+        self._predicates.append((attribute, op, value))
+        return self
+
+    def order_by(self, attribute: str, descending: bool = False) -> 'Query':
+        """ Sort results by `attribute`
+        """
+        self._order = attribute
+        self._descending = descending
+        return self
+
+    def limit(self, limit: int) -> 'Query':
+        """ Return at most `limit` objects
+        """
+        if limit < 0:
+            raise ValueError("limit must be positive")
+        self._limit = limit
+        return self
+
+    def offset(self, offset: int) -> 'Query':
+        """ Skip the first `offset` matching objects
+        """
+        if offset < 0:
+            raise ValueError("offset must be positive")
+        self._offset = offset
+        return self
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> TypeVar('Base'):
+        """ First matching object, or None
+        """
+        for obj in self:
+            return obj
+        return None
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the matching objects
+        """
+        if self._limit == 0:
+            return
+        objs = self._matches()
+        if self._order != 'id':
+            objs = self._sorted(objs)
+        skipped, returned = 0, 0
+        for obj in objs:
+            if skipped < self._offset:
+                skipped += 1
+                continue
+            yield obj
+            returned += 1
+            if self._limit is not None and returned >= self._limit:
+                return
+
+    def explain(self) -> str:
+        """ Plan chosen for the query: 'index <attribute>', 'id range'
+        or 'scan'
+        """
+        self._cls._sync()
+        with self._cls._lock().read():
+            return self._plan()[0]
+
+    def _matches(self) -> Iterator[TypeVar('Base')]:
+        """ Matching objects in ID order (reversed if descending)
+        """
+        self._cls._sync()
+        with self._cls._lock().read():
+            ids = self._plan()[1]
+        if self._order == 'id' and self._descending:
+            ids = ids[::-1]
+        for start in range(0, len(ids), FETCH_SIZE):
+            for obj in self._cls._fetch(ids[start:start + FETCH_SIZE]):
+                if self._match(obj):
+                    yield obj
+
+    def _match(self, obj: TypeVar('Base')) -> bool:
+        """ True if the object satisfies every predicate
+        """
+        for attribute, op, value in self._predicates:
+            try:
+                if not OPERATORS[op](getattr(obj, attribute, None), value):
+                    return False
+            except TypeError:  # e.g. None < "a"
+                return False
+        return True
+
+    def _sorted(self, objs: Iterator[TypeVar('Base')]) -> list:
+        """ Objects sorted by the order_by attribute, None values last
+        """
+        present = []
+        missing = []
+        for obj in objs:
+            if getattr(obj, self._order, None) is None:
+                missing.append(obj)
+            else:
+                present.append(obj)
+        try:
+            present.sort(key=lambda obj: getattr(obj, self._order),
+                         reverse=self._descending)
+        except TypeError:
+            raise ValueError("can't order by {}".format(self._order))
+        return present + missing
+
+    def _plan(self) -> tuple:
+        """ (description, sorted candidate IDs) with the fewest
+        candidates (class read lock held)
+        """
+        ordered = self._cls._ordered_ids()
+        best = ('scan', ordered)
+        indexes = self._cls._indexes()
+        for attribute, op, value in self._predicates:
+            ids = None
+            if attribute == 'id':
+                ids = self._id_range(ordered, op, value)
+                plan = 'id range'
+            elif attribute in indexes and op in ('eq', 'in'):
+                ids = self._index_lookup(indexes[attribute], op, value)
+                plan = 'index {}'.format(attribute)
+            if ids is not None and len(ids) < len(best[1]):
+                best = (plan, ids)
+        if best[0] == 'scan':
+            return 'scan', list(ordered)
+        if best[0].startswith('index'):
+            return best[0], sorted(best[1])
+        return best
+
+    @staticmethod
+    def _index_lookup(index, op: str, value) -> set:
+        """ IDs an index returns for an eq/in predicate, or None
+        """
+        values = [value] if op == 'eq' else value
+        ids = set()
+        for v in values:
+            found = index.lookup(v)
+            if found is None:
+                return None
+            ids |= found
+        return ids
+
+    @staticmethod
+    def _id_range(ordered: list, op: str, value) -> list:
+        """ Slice of the sorted IDs a predicate on `id` can match,
+        or None
+        """
+        if not isinstance(value, str) and op != 'in':
+            return None
+        if op == 'eq':
+            i = bisect.bisect_left(ordered, value)
+            return ordered[i:i + 1]
+        if op == 'in':
+            ids = []
+            for v in sorted(set(v for v in value if isinstance(v, str))):
+                i = bisect.bisect_left(ordered, v)
+                if i < len(ordered) and ordered[i] == v:
+                    ids.append(v)
+            return ids
+        if op == 'prefix':
+            i = bisect.bisect_left(ordered, value)
+            j = i
+            while j < len(ordered) and ordered[j].startswith(value):
+                j += 1
+            return ordered[i:j]
+        if op in ('gt', 'ge'):
+            find = bisect.bisect_right if op == 'gt' else bisect.bisect_left
+            return ordered[find(ordered, value):]
+        if op in ('lt', 'le'):
+            find = bisect.bisect_left if op == 'lt' else bisect.bisect_right
+            return ordered[:find(ordered, value)]
+        return None
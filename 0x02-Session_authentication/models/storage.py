@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+""" Storage module: low level file helpers used by models.base
+"""
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from os import path
+from typing import Callable, Iterable, Tuple
+import atexit
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+CHUNK_SIZE = 1 << 16
+LOGGER = logging.getLogger(__name__)
+
+# Binary snapshot layout:
+#   header:  magic, record count, index offset, id width, values offset
+#   records: 4-byte length + JSON payload (timestamps as epoch seconds)
+#   index:   one fixed-width entry per record, sorted by id:
+#            id (NUL padded to the id width) + 8-byte record offset
+#   values:  per indexed attribute whose values are strings or null,
+#            (JSON value, id) entries (4-byte length + bytes each),
+#            then their 8-byte offsets sorted by (value, id)
+#   values directory (at the values offset): 4-byte attribute count, then
+#            per attribute: 4-byte length + name, entry count, offset of
+#            the sorted offsets
+# BDB1 snapshots (no values) are still read.
+BINARY_MAGIC = b"BDB2"
+BINARY_HEADER = struct.Struct("<4sQQIQ")
+BINARY_MAGIC_V1 = b"BDB1"
+BINARY_HEADER_V1 = struct.Struct("<4sQQI")
+BINARY_LENGTH = struct.Struct("<I")
+BINARY_OFFSET = struct.Struct("<Q")
+
+
+def iter_snapshot(file_path: str, chunk_size: int = CHUNK_SIZE):
+    """ Iterate over the (id, object JSON) pairs of a snapshot file
+
+    The file is parsed incrementally, so only one object (plus one read
+    chunk) is held in memory at a time instead of the whole document.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r') as f:
+        state = {'buf': "", 'pos': 0, 'eof': False}
+
+        def fill() -> bool:
+            """ Read one more chunk, dropping what was already parsed """
+            if state['eof']:
+                return False
+            chunk = f.read(chunk_size)
+            if len(chunk) == 0:
+                state['eof'] = True
+                return False
+            state['buf'] = state['buf'][state['pos']:] + chunk
+            state['pos'] = 0
+            return True
+
+        def next_char() -> str:
+            """ Skip whitespace and return the next character """
+            while True:
+                buf, pos = state['buf'], state['pos']
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                state['pos'] = pos
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    return ""
+
+        def expect(chars: str) -> str:
+            """ Consume one of `chars` """
+            char = next_char()
+            if char == "" or char not in chars:
+                raise ValueError("Malformed snapshot {}".format(file_path))
+            state['pos'] += 1
+            return char
+
+        def decode():
+            """ Decode the next complete JSON value """
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(state['buf'],
+                                                    state['pos'])
+                    if end < len(state['buf']) or state['eof']:
+                        state['pos'] = end
+                        return value
+                except json.JSONDecodeError:
+                    if state['eof']:
+                        raise
+                fill()
+
+        if next_char() == "":
+            return
+        expect("{")
+        if next_char() == "}":
+            return
+        while True:
+            obj_id = decode()
+            expect(":")
+            yield obj_id, decode()
+            if expect(",}") == "}":
+                return
+
+
+def _tmp_path(file_path: str) -> str:
+    """ Temporary path private to the calling process and thread
+    """
+    return "{}.{}-{}.tmp".format(file_path, os.getpid(),
+                                 threading.get_ident())
+
+
+def _sync(f):
+    """ Flush a file object down to the disk
+    """
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def write_snapshot(file_path: str, objs_json: Iterable[Tuple[str, dict]],
+                   sync: bool = False):
+    """ Write a full snapshot atomically (temporary file + rename)
+
+    Objects are encoded one at a time from the (id, object JSON) pairs.
+    With `sync`, the file is fsync-ed before being renamed.
+    """
+    tmp_path = _tmp_path(file_path)
+    with open(tmp_path, 'w') as f:
+        separator = "{"
+        for obj_id, obj_json in objs_json:
+            f.write("{}{}: {}".format(separator, json.dumps(obj_id),
+                                      json.dumps(obj_json)))
+            separator = ", "
+        f.write("{}" if separator == "{" else "}")
+        if sync:
+            _sync(f)
+    os.replace(tmp_path, file_path)
+
+
+def _write_chunk(f, chunk: bytes):
+    """ Write a length-prefixed chunk """
+    f.write(BINARY_LENGTH.pack(len(chunk)))
+    f.write(chunk)
+
+
+def write_binary(file_path: str, payloads: Iterable[Tuple[str, bytes]],
+                 sync: bool = False, indexed: Iterable[str] = ()):
+    """ Write a binary snapshot atomically from (id, payload) pairs
+
+    The values of the `indexed` attributes are written too, so the
+    indexes of a mapped snapshot need no decoding (see
+    BinaryTable.value_ids).
+    """
+    tmp_path = _tmp_path(file_path)
+    index = []
+    values = {attribute: [] for attribute in indexed}
+    with open(tmp_path, 'wb') as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, 0, 0, 0, 0))
+        for obj_id, payload in payloads:
+            index.append((obj_id.encode(), f.tell()))
+            _write_chunk(f, payload)
+            if len(values) > 0:
+                obj_json = json.loads(payload)
+                for attribute, pairs in values.items():
+                    pairs.append((obj_json.get(attribute), obj_id))
+        index.sort()
+        width = max((len(key) for key, _ in index), default=0)
+        index_offset = f.tell()
+        for key, offset in index:
+            f.write(key.ljust(width, b"\0"))
+            f.write(BINARY_OFFSET.pack(offset))
+        sections = []
+        for attribute, pairs in values.items():
+            if any(v is not None and not isinstance(v, str)
+                   for v, _ in pairs):
+                continue
+            entries = sorted((json.dumps(v).encode(), obj_id.encode())
+                             for v, obj_id in pairs)
+            offsets = []
+            for key, obj_id in entries:
+                offsets.append(f.tell())
+                _write_chunk(f, key)
+                _write_chunk(f, obj_id)
+            sections.append((attribute, len(entries), f.tell()))
+            for offset in offsets:
+                f.write(BINARY_OFFSET.pack(offset))
+        values_offset = f.tell()
+        f.write(BINARY_LENGTH.pack(len(sections)))
+        for attribute, count, offsets_offset in sections:
+            _write_chunk(f, attribute.encode())
+            f.write(BINARY_OFFSET.pack(count))
+            f.write(BINARY_OFFSET.pack(offsets_offset))
+        f.seek(0)
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, len(index),
+                                   index_offset, width, values_offset))
+        if sync:
+            _sync(f)
+    os.replace(tmp_path, file_path)
+
+
+class BinaryTable(MutableMapping):
+    """ Mapping of id -> object backed by a memory-mapped binary snapshot
+
+    Opening the table only reads the header: lookups binary-search the
+    sorted index in place and objects are decoded on first access.
+    Inserted, replaced and removed objects live in an in-memory overlay.
+    Attribute values written with the snapshot are binary-searched the
+    same way.
+    """
+
+    def __init__(self, file_path: str, decode: Callable[[bytes], object]):
+        """ Map `file_path`; `decode` builds an object from a payload
+        """
+        self._decode = decode
+        with open(file_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._mm[:len(BINARY_MAGIC)]
+        self._values = {}
+        if magic == BINARY_MAGIC:
+            _, self._count, self._index, self._width, values_offset = \
+                BINARY_HEADER.unpack_from(self._mm, 0)
+            self._read_values(values_offset)
+        elif magic == BINARY_MAGIC_V1:
+            _, self._count, self._index, self._width = \
+                BINARY_HEADER_V1.unpack_from(self._mm, 0)
+        else:
+            raise ValueError("Not a binary snapshot: {}".format(file_path))
+        self._entry = self._width + BINARY_OFFSET.size
+        self._objects = {}
+        self._removed = set()
+        self._new = set()
+
+    def _chunk(self, offset: int) -> Tuple[bytes, int]:
+        """ Length-prefixed chunk at `offset`, and the offset after it """
+        length = BINARY_LENGTH.unpack_from(self._mm, offset)[0]
+        start = offset + BINARY_LENGTH.size
+        return self._mm[start:start + length], start + length
+
+    def _read_values(self, offset: int):
+        """ Read the values directory: {attribute: (count, offsets)} """
+        sections = BINARY_LENGTH.unpack_from(self._mm, offset)[0]
+        offset += BINARY_LENGTH.size
+        for _ in range(sections):
+            name, offset = self._chunk(offset)
+            count, offsets = struct.unpack_from("<QQ", self._mm, offset)
+            offset += 2 * BINARY_OFFSET.size
+            self._values[name.decode()] = (count, offsets)
+
+    def has_values(self, attribute: str) -> bool:
+        """ True if the snapshot holds the values of `attribute` """
+        return attribute in self._values
+
+    def value_ids(self, attribute: str, value) -> list:
+        """ IDs of the snapshot records whose `attribute` was `value` when
+        the snapshot was written (removed and replaced records included)
+        """
+        if value is not None and not isinstance(value, str):
+            return []
+        count, offsets = self._values[attribute]
+        key = json.dumps(value).encode()
+
+        def entry(i: int) -> Tuple[bytes, int]:
+            offset = BINARY_OFFSET.unpack_from(
+                self._mm, offsets + i * BINARY_OFFSET.size)[0]
+            return self._chunk(offset)
+
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        ids = []
+        while lo < count:
+            found, offset = entry(lo)
+            if found != key:
+                break
+            ids.append(self._chunk(offset)[0].decode())
+            lo += 1
+        return ids
+
+    def overlay(self) -> Tuple[dict, set]:
+        """ (objects decoded or inserted by ID, removed IDs) """
+        return self._objects, self._removed
+
+    def _padded(self, i: int) -> bytes:
+        """ Raw (NUL padded) ID of the i-th index entry """
+        start = self._index + i * self._entry
+        return self._mm[start:start + self._width]
+
+    def _key(self, i: int) -> str:
+        """ ID of the i-th index entry """
+        return self._padded(i).rstrip(b"\0").decode()
+
+    def _offset(self, obj_id: str) -> int:
+        """ Record offset of an ID in the snapshot, or None """
+        key = obj_id.encode()
+        if len(key) > self._width:
+            return None
+        key = key.ljust(self._width, b"\0")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._padded(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._count or self._padded(lo) != key:
+            return None
+        return BINARY_OFFSET.unpack_from(
+            self._mm, self._index + lo * self._entry + self._width)[0]
+
+    def _in_snapshot(self, obj_id: str) -> bool:
+        """ True if the ID is a live record of the snapshot """
+        return obj_id not in self._removed and \
+            self._offset(obj_id) is not None
+
+    def payload(self, obj_id: str) -> bytes:
+        """ Raw payload of a record never decoded nor replaced, or None
+        """
+        if obj_id in self._objects or obj_id in self._removed:
+            return None
+        offset = self._offset(obj_id)
+        if offset is None:
+            return None
+        length = BINARY_LENGTH.unpack_from(self._mm, offset)[0]
+        start = offset + BINARY_LENGTH.size
+        return bytes(self._mm[start:start + length])
+
+    def __getitem__(self, obj_id: str):
+        """ Object by ID, decoded on first access """
+        if obj_id in self._objects:
+            return self._objects[obj_id]
+        payload = self.payload(obj_id)
+        if payload is None:
+            raise KeyError(obj_id)
+        obj = self._decode(payload)
+        self._objects[obj_id] = obj
+        return obj
+
+    def __setitem__(self, obj_id: str, obj):
+        """ Insert or replace an object """
+        # A removed snapshot record saved again is iterated as a snapshot
+        # ID once un-removed: only IDs without any record are new
+        if obj_id not in self._objects and self._offset(obj_id) is None:
+            self._new.add(obj_id)
+        self._removed.discard(obj_id)
+        self._objects[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object """
+        if obj_id not in self:
+            raise KeyError(obj_id)
+        self._objects.pop(obj_id, None)
+        if obj_id in self._new:
+            self._new.discard(obj_id)
+        else:
+            self._removed.add(obj_id)
+
+    def __contains__(self, obj_id) -> bool:
+        """ True if the ID is present """
+        if not isinstance(obj_id, str):
+            return False
+        return obj_id in self._objects or self._in_snapshot(obj_id)
+
+    def __iter__(self):
+        """ IDs of the snapshot (in id order), then inserted IDs """
+        for i in range(self._count):
+            obj_id = self._key(i)
+            if obj_id not in self._removed:
+                yield obj_id
+        for obj_id in list(self._new):
+            if obj_id in self._new:
+                yield obj_id
+
+    def __len__(self) -> int:
+        """ Number of objects """
+        return self._count - len(self._removed) + len(self._new)
+
+
+def append_records(file_path: str, records: list, sync: bool = False):
+    """ Append journal records, one JSON document per line
+    """
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with open(file_path, 'a') as f:
+        f.write(lines)
+        if sync:
+            _sync(f)
+
+
+def sync_file(file_path: str):
+    """ Flush a file written by another file object down to the disk
+    """
+    with open(file_path, 'a') as f:
+        os.fsync(f.fileno())
+
+
+def iter_records(file_path: str, offset: int = 0):
+    """ Iterate over the (record, end offset) of a journal file,
+    starting at byte `offset`
+
+    A trailing partial line (interrupted or ongoing write) is ignored.
+    """
+    if not path.exists(file_path):
+        return
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            line = line.strip()
+            if len(line) > 0:
+                yield json.loads(line), offset
+
+
+def signature(file_path: str) -> tuple:
+    """ Identity of a file version (inode, mtime, size), or None
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def file_size(file_path: str) -> int:
+    """ Size of a file, 0 if it doesn't exist
+    """
+    try:
+        return os.stat(file_path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+@contextmanager
+def file_lock(file_path: str, shared: bool = False):
+    """ Hold an advisory lock on `file_path` across processes
+
+    A no-op where fcntl is not available.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(file_path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def truncate(file_path: str):
+    """ Drop a journal once its records are part of a snapshot
+    """
+    if path.exists(file_path):
+        os.remove(file_path)
+
+
+class Flusher():
+    """ Write-behind buffer: pending records are handed over to `write`
+    by a background thread, grouped per class
+
+    A flush happens every `interval` seconds, as soon as `batch` records
+    are pending, and at interpreter exit. Records whose write fails stay
+    pending and are retried at the next flush.
+    """
+
+    def __init__(self, write: Callable[[type, list], None],
+                 interval: float, batch: int):
+        """ Initialize an idle flusher
+        """
+        self._write = write
+        self._interval = interval
+        self._batch = batch
+        self._pending = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def add(self, cls: type, records: list):
+        """ Queue records of a class; never waits on I/O
+        """
+        with self._cond:
+            self._pending.setdefault(cls, []).extend(records)
+            self._count += max(len(records), 1)
+            if self._thread is None or self._pid != os.getpid() or \
+                    not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            if self._count >= self._batch:
+                self._cond.notify()
+
+    def flush(self):
+        """ Write every pending record now
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._count = 0
+            try:
+                for cls in list(pending):
+                    self._write(cls, pending[cls])
+                    del pending[cls]
+            except Exception:
+                # Queued again in front of newer records of the class
+                with self._cond:
+                    for cls, records in pending.items():
+                        self._pending[cls] = records + \
+                            self._pending.get(cls, [])
+                        self._count += len(records)
+                raise
+
+    def _run(self):
+        """ Background loop of the flusher thread
+        """
+        while True:
+            with self._cond:
+                if self._count < self._batch:
+                    self._cond.wait(self._interval)
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("write-behind flush failed, retrying")
+                time.sleep(self._interval)
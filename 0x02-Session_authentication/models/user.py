@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """ User module
 """
-import hashlib
-from models.base import Base
+from models.base import Base, model_slots
+from models.password import HASHER
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = model_slots('email', '_password', 'first_name',
+                            'last_name')
+    indexed_attributes = ('email',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -26,22 +29,29 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: hash it with the default scheme
         """
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            self._password = HASHER.hash(pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
+
+        A valid password stored with an outdated scheme or cost is
+        rehashed and saved.
         """
         if pwd is None or type(pwd) is not str:
             return False
         if self.password is None:
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        if not HASHER.verify(pwd, self.password):
+            return False
+        if HASHER.needs_rehash(self.password):
+            self.password = pwd
+            self.save()
+        return True
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
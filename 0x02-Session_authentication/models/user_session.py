@@ -3,11 +3,14 @@
 UserSession model for storing session information in the database (file).
 """
 
-from models.base import Base
+from models.base import Base, model_slots
 
 
 class UserSession(Base):
     """Represents a user session stored in the database."""
+    __slots__ = model_slots('user_id', 'session_id')
+    indexed_attributes = ('session_id',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """Initialize UserSession with user_id and session_id."""
         super().__init__(*args, **kwargs)
@@ -4,11 +4,30 @@
 from flask import Flask, jsonify, request, abort, redirect
 
 from auth import Auth  # Import authentication functionality.
+from kdf_pool import PoolSaturated
 
 app = Flask(__name__)  # Initialize the Flask application.
 AUTH = Auth()  # Create an instance of the Auth class.
 
 
+@app.errorhandler(PoolSaturated)
+def busy(error) -> str:
+    """Password hashing pool is full.
+    Return:
+        - 503 with a Retry-After header.
+    """
+    response = jsonify({"message": "server busy"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+@app.teardown_request
+def close_session(exception) -> None:
+    """Releases the request thread's database session.
+    """
+    AUTH.close_session()
+
+
 @app.route("/", methods=["GET"], strict_slashes=False)
 def index() -> str:
     """GET /
@@ -57,7 +76,7 @@ def logout() -> str:
     user = AUTH.get_user_from_session_id(session_id)  # user session ID.
     if user is None:
         abort(403)  # Abort with 403 status code if user is not found.
-    AUTH.destroy_session(user.id)  # Destroy the user's session.
+    AUTH.destroy_session(user.id, session_id)  # Destroy this session only.
     return redirect("/")  # Redirect to the home route.
 
 
@@ -1,14 +1,41 @@
 #!/usr/bin/env python3
 """A module for authentication-related routines.
 """
-import bcrypt  # Library for password hashing.
+import os
+from datetime import datetime, timedelta
 from uuid import uuid4  # Used to generate unique session and reset tokens.
 from typing import Union  # Enables type hints for functions returning multiple types.
 from sqlalchemy.orm.exc import NoResultFound  # Exception for missing database records.
 
+from cache import SessionCache, SessionUser  # Cache of session lookups.
 from db import DB  # Import the database interface.
+from kdf_pool import KDFPool  # Bounded pool for bcrypt work.
+from password import BcryptHasher  # Password hashing with a tuned cost.
 from user import User  # Import the User model.
 
+# bcrypt runs on its own bounded pool so logins can't starve other requests.
+KDF_POOL = KDFPool(
+    max_workers=int(os.getenv("KDF_WORKERS", (os.cpu_count() or 2) - 1 or 1)),
+    max_queue=int(os.getenv("KDF_QUEUE", "64")),
+    timeout=float(os.getenv("KDF_QUEUE_TIMEOUT", "1")),
+)
+
+# Cost calibrated to PASSWORD_HASH_TARGET_MS unless BCRYPT_ROUNDS is set.
+HASHER = BcryptHasher(
+    rounds=int(os.environ["BCRYPT_ROUNDS"])
+    if os.getenv("BCRYPT_ROUNDS") else None,
+    target_ms=float(os.getenv("PASSWORD_HASH_TARGET_MS", "250")),
+)
+
+# Sessions resolved recently, so /profile doesn't query the database.
+SESSION_CACHE = SessionCache(
+    max_size=int(os.getenv("SESSION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "60")),
+)
+
+# Lifetime of a session in seconds, 0 for sessions that never expire.
+SESSION_DURATION = int(os.getenv("SESSION_DURATION", "0"))
+
 
 def _hash_password(password: str) -> bytes:
     """Hashes a password.
@@ -18,8 +45,11 @@ def _hash_password(password: str) -> bytes:
     
     Returns:
         bytes: The hashed password.
+    
+    Raises:
+        PoolSaturated: If the hashing pool is overloaded.
     """
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    return KDF_POOL.run(HASHER.hash, password)
 
 
 def _generate_uuid() -> str:
@@ -40,6 +70,11 @@ class Auth:
         """
         self._db = DB()  # Initialize a database instance.
 
+    def close_session(self) -> None:
+        """Releases the database session of the current thread.
+        """
+        self._db.close_session()
+
     def register_user(self, email: str, password: str) -> User:
         """Adds a new user to the database.
         
@@ -62,28 +97,40 @@ class Auth:
     def valid_login(self, email: str, password: str) -> bool:
         """Checks if a user's login details are valid.
         
+        On success, a hash made with outdated parameters is replaced by
+        one with the current cost.
+        
         Args:
             email (str): The user's email.
             password (str): The user's plaintext password.
         
         Returns:
             bool: True if login is valid, otherwise False.
+        
+        Raises:
+            PoolSaturated: If the hashing pool is overloaded.
         """
         user = None
         try:
             user = self._db.find_user_by(email=email)  # Fetch user by email.
-            if user is not None:
-                return bcrypt.checkpw(
-                    password.encode("utf-8"),
-                    user.hashed_password,
-                )  # Compare hashed passwords.
         except NoResultFound:
             return False  # Return False if user does not exist.
-        return False
+        if user is None:
+            return False
+        if not KDF_POOL.run(HASHER.verify, password, user.hashed_password):
+            return False  # Compare hashed passwords.
+        if HASHER.needs_rehash(user.hashed_password):
+            self._db.update_user(
+                user.id,
+                hashed_password=_hash_password(password),
+            )  # Store the hash with the current cost.
+        return True
 
     def create_session(self, email: str) -> str:
         """Creates a new session for a user.
         
+        The user's other sessions (other devices) stay valid.
+        
         Args:
             email (str): The user's email address.
         
@@ -98,36 +145,63 @@ class Auth:
         if user is None:
             return None
         session_id = _generate_uuid()  # Generate a unique session ID.
-        self._db.update_user(user.id, session_id=session_id)  # Update user with session ID.
+        expires_at = None
+        if SESSION_DURATION > 0:
+            expires_at = datetime.utcnow() + timedelta(seconds=SESSION_DURATION)
+        self._db.add_session(user.id, session_id, expires_at)  # Store the session.
         return session_id
 
-    def get_user_from_session_id(self, session_id: str) -> Union[User, None]:
+    def get_user_from_session_id(
+            self, session_id: str) -> Union[SessionUser, None]:
         """Retrieves a user based on a given session ID.
         
+        Recently resolved sessions are answered from SESSION_CACHE.
+        
         Args:
             session_id (str): The session ID associated with the user.
         
         Returns:
-            Union[User, None]: The user instance or None if not found.
+            Union[SessionUser, None]: The user's id and email or None if
+            not found.
         """
         user = None
         if session_id is None:
             return None
+        cached = SESSION_CACHE.get(session_id)
+        if cached is not None:
+            return cached
+        version = SESSION_CACHE.version  # Read before the database.
         try:
-            user = self._db.find_user_by(session_id=session_id)  # Fetch user by session ID.
+            user, expires_at = self._db.find_session_user(session_id)  # Fetch the session's user.
         except NoResultFound:
-            return None  # Return None if session is invalid.
-        return user
+            return None  # Return None if session is invalid or expired.
+        ttl = None
+        if expires_at is not None:
+            ttl = (expires_at - datetime.utcnow()).total_seconds()
+        cached = SessionUser(user.id, user.email)
+        SESSION_CACHE.put(session_id, cached, version, ttl)
+        return cached
 
-    def destroy_session(self, user_id: int) -> None:
+    def destroy_session(self, user_id: int, session_id: str = None) -> None:
         """Destroys a session associated with a given user.
         
         Args:
             user_id (int): The user's ID.
+            session_id (str): The session to destroy, or None to destroy
+                all of the user's sessions.
         """
         if user_id is None:
             return None
-        self._db.update_user(user_id, session_id=None)  # Remove session ID from user.
+        self._db.delete_sessions(user_id, session_id)  # Delete the session rows.
+        SESSION_CACHE.invalidate_user(user_id)
+
+    def purge_expired_sessions(self) -> int:
+        """Deletes every expired session.
+        
+        Returns:
+            int: The number of deleted sessions.
+        """
+        return self._db.delete_expired_sessions()
 
     def get_reset_password_token(self, email: str) -> str:
         """Generates a password reset token for a user.
@@ -174,4 +248,5 @@ class Auth:
             user.id,
             hashed_password=new_password_hash,
             reset_token=None,  # Remove reset token after password update.
-        )
\ No newline at end of file
+        )
+        SESSION_CACHE.invalidate_user(user.id)
\ No newline at end of file
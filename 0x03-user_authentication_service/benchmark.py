@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""A benchmark of `DB`: threads sharing one session vs. scoped sessions."""
+
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.session import Session
+
+from db import DB
+
+USERS = 1000       # Users in the database
+THREADS = 8        # Concurrent "request" threads
+OPERATIONS = 500   # Operations per thread, one in ten is an update
+
+
+class SharedSessionDB(DB):
+    """DB with one session for all threads, as before scoped sessions."""
+
+    def __init__(self) -> None:
+        """Initialize the database and its single session."""
+        super().__init__()
+        self._shared = sessionmaker(bind=self._engine,
+                                    expire_on_commit=False)()
+
+    @property
+    def _session(self) -> Session:
+        """The session shared by every thread."""
+        return self._shared
+
+    def close_session(self) -> None:
+        """Keeps the shared session open."""
+
+
+def worker(db: DB, lock) -> None:
+    """Runs OPERATIONS lookups/updates, one "request" each."""
+    for _ in range(OPERATIONS):
+        email = "user{}@holberton.io".format(random.randrange(USERS))
+        with lock:  # A shared session can't be used by two threads at once
+            user = db.find_user_by(email=email)
+            if random.random() < 0.1:
+                db.update_user(user.id, session_id=str(random.random()))
+            db.close_session()  # Request teardown
+
+
+def run(db: DB, lock) -> float:
+    """Runs THREADS workers and returns the operations per second."""
+    threads = [threading.Thread(target=worker, args=(db, lock))
+               for _ in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return THREADS * OPERATIONS / (time.perf_counter() - start)
+
+
+def seed(db: DB) -> None:
+    """Adds USERS users."""
+    for i in range(USERS):
+        db.add_user("user{}@holberton.io".format(i), "hashed")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DB_URL", "sqlite:///benchmark.db")
+    shared = SharedSessionDB()                    # Drops and creates tables
+    seed(shared)
+    print("shared session: {:.0f} ops/s".format(
+        run(shared, threading.Lock())))
+    os.environ["DB_PERSISTENT"] = "1"             # Keep the seeded users
+    print("scoped sessions: {:.0f} ops/s".format(run(DB(), nullcontext())))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""A module for caching session lookups in process.
+"""
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+# What the routes need from a session's user, detached from the database.
+SessionUser = namedtuple("SessionUser", ["id", "email"])
+
+
+class SessionCache:
+    """Bounded LRU cache of session ID -> SessionUser, with a TTL.
+
+    Entries are dropped per user by `invalidate_user` whenever sessions
+    are destroyed or a password changes. A lookup that started
+    before an invalidation can't store its (possibly stale) result: `put`
+    is given the `version` read before querying the database.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        """Initializes an empty cache.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._entries = OrderedDict()  # session ID -> (user, expiry)
+        self._sessions = {}  # user ID -> cached session IDs
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> SessionUser:
+        """Returns the cached user of a session, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(session_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, session_id: str, user: SessionUser, version: int,
+            ttl: float = None) -> None:
+        """Caches the user of a session.
+
+        Args:
+            session_id (str): The session ID.
+            user (SessionUser): The session's user.
+            version (int): `version` read before loading the user.
+            ttl (float): Time left before the session expires, if shorter
+                than the cache's TTL.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if version != self.version:  # Invalidated in the meantime
+                return
+            self._remove(session_id)
+            if ttl is None or ttl > self.ttl:
+                ttl = self.ttl
+            self._entries[session_id] = (user, time.monotonic() + ttl)
+            self._sessions.setdefault(user.id, set()).add(session_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drops every cached session of a user.
+        """
+        with self._lock:
+            self.version += 1
+            for session_id in list(self._sessions.get(user_id, ())):
+                self._remove(session_id)
+
+    def stats(self) -> dict:
+        """Returns the size and hit/miss counters of the cache.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, session_id: str) -> None:
+        """Drops a cached session, with the lock held.
+        """
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        session_ids = self._sessions[entry[0].id]
+        session_ids.discard(session_id)
+        if len(session_ids) == 0:
+            del self._sessions[entry[0].id]
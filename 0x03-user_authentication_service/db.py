@@ -4,14 +4,84 @@ This module contains the DB class for interacting with the SQLite
 database, handling user operations such as adding, finding, and
 updating users.
 """
-from sqlalchemy import create_engine, tuple_
-from sqlalchemy.exc import InvalidRequestError
+import os
+from datetime import datetime
+
+from sqlalchemy import (
+    create_engine, delete, event, insert, inspect, or_, select, update,
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import (
+    IntegrityError, InvalidRequestError, OperationalError, ProgrammingError,
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
+from typing import Dict, Tuple
+from sqlalchemy.pool import QueuePool
+
+from user import (
+    ADDITIVE_VERSIONS, SCHEMA_VERSION, Base, SchemaVersion, User,
+    UserSession,
+)
+
+# Attempts at creating the missing tables when workers start together
+CREATE_ATTEMPTS = 5
+
+# SQLite pragmas applied to every new connection, selected by DB_PROFILE.
+# WAL lets readers run alongside the writer in all profiles; they trade
+# durability of the last commits for fewer fsyncs and bigger caches.
+SQLITE_PROFILES = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",  # fsync on every commit
+        "mmap_size": 0,
+        "cache_size": -2000,  # In KiB
+        "busy_timeout": 5000,  # In ms
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",  # fsync at checkpoints only
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+        "busy_timeout": 5000,
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",  # Leave fsync to the OS
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def _sqlite_pragmas() -> dict:
+    """Pragmas of the DB_PROFILE preset.
+
+    Each one can be overridden with DB_PRAGMA_<NAME>, e.g.
+    DB_PRAGMA_SYNCHRONOUS=FULL.
+
+    Returns:
+        dict: The pragma values by name.
+
+    Raises:
+        ValueError: If the profile is unknown.
+    """
+    profile = os.getenv("DB_PROFILE", "balanced")
+    if profile not in SQLITE_PROFILES:
+        raise ValueError("unknown DB_PROFILE {}".format(profile))
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for name in pragmas:
+        pragmas[name] = os.getenv("DB_PRAGMA_" + name.upper(), pragmas[name])
+    return pragmas
+
 
-from user import Base, User
+class SchemaMismatch(Exception):
+    """Raised when the database was created with another schema version.
+    """
 
 
 class DB:
@@ -21,22 +91,142 @@ class DB:
 
     def __init__(self) -> None:
         """Initialize a new DB instance.
-        Sets up the SQLite database and creates the tables.
+        Connects to DB_URL (default `sqlite:///a.db`) and creates the
+        tables. The tables are dropped first unless DB_PERSISTENT is set,
+        in which case existing data is kept and only missing tables are
+        created. The connection pool is sized by DB_POOL_SIZE,
+        DB_MAX_OVERFLOW and DB_POOL_TIMEOUT, and SQLite connections use
+        the DB_PROFILE pragmas.
+
+        Raises:
+            SchemaMismatch: If the database has another schema version.
+        """
+        url = make_url(os.getenv("DB_URL", "sqlite:///a.db"))
+        options = {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            "pool_pre_ping": True,  # Drop connections that went stale
+        }
+        sqlite = url.get_backend_name() == "sqlite"
+        if sqlite:
+            options["poolclass"] = QueuePool
+            # Pooled connections are handed to whichever thread needs one
+            options["connect_args"] = {"check_same_thread": False}
+        self._engine = create_engine(url, echo=False, **options)
+        if sqlite:
+            pragmas = _sqlite_pragmas()
+
+            @event.listens_for(self._engine, "connect")
+            def set_pragmas(connection, _) -> None:
+                """Applies the SQLite profile to a new connection.
+                """
+                cursor = connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute("PRAGMA {} = {}".format(name, value))
+                cursor.close()
+
+        persistent = os.getenv("DB_PERSISTENT", "0").lower()
+        if persistent not in ("1", "true", "yes"):
+            Base.metadata.drop_all(self._engine)  # Drops all tables
+        unversioned = self._unversioned()
+        self._create_tables()
+        self._check_schema(unversioned)
+        # One session per thread; loaded users stay usable after commit
+        self.__session = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False)
+        )
+
+    def _create_tables(self) -> None:
+        """Creates the missing tables.
+        Workers starting together on a new database may all find a table
+        missing: those beaten to creating it retry, and then skip it.
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)  # Drops all tables
-        Base.metadata.create_all(self._engine)  # Creates tables
-        self.__session = None  # Initialize session as None
+        for attempt in range(CREATE_ATTEMPTS):
+            try:
+                # schema_version first, so a process that finds `users`
+                # finds it too (see _unversioned)
+                Base.metadata.create_all(
+                    self._engine, tables=[SchemaVersion.__table__],
+                    checkfirst=True,
+                )
+                Base.metadata.create_all(self._engine, checkfirst=True)
+                return
+            except (OperationalError, ProgrammingError):  # Already exists
+                if attempt == CREATE_ATTEMPTS - 1:
+                    raise
+
+    def _unversioned(self) -> bool:
+        """Whether the database has users but no schema version table.
+        Such a database predates schema versions: its `users` table may
+        lack columns or constraints that create_all won't add.
+        """
+        inspector = inspect(self._engine)
+        return (inspector.has_table(User.__tablename__) and
+                not inspector.has_table(SchemaVersion.__tablename__))
+
+    def _check_schema(self, unversioned: bool) -> None:
+        """Checks the schema version of the database.
+        A database without one is stamped with SCHEMA_VERSION, unless it
+        is `unversioned`. The schema_version table is created before the
+        others, so one found empty with `users` was just created by this
+        or another process, which is about to stamp it. A database of one
+        of ADDITIVE_VERSIONS is restamped, as create_all just added the
+        tables it lacked.
+
+        Args:
+            unversioned (bool): If the tables predate schema versions.
+
+        Raises:
+            SchemaMismatch: If the database has another schema version.
+        """
+        if unversioned:
+            raise SchemaMismatch(
+                "database schema has no version, expected {}".format(
+                    SCHEMA_VERSION,
+                )
+            )
+        with self._engine.begin() as connection:
+            version = connection.execute(
+                select(SchemaVersion.version)
+            ).scalar()
+            if version is None:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(insert(SchemaVersion).values(
+                            version=SCHEMA_VERSION,
+                        ))
+                    return
+                except IntegrityError:  # Stamped by another process
+                    version = connection.execute(
+                        select(SchemaVersion.version)
+                    ).scalar()
+            if version in ADDITIVE_VERSIONS:
+                connection.execute(
+                    update(SchemaVersion)
+                    .where(SchemaVersion.version == version)
+                    .values(version=SCHEMA_VERSION)
+                )
+                version = SCHEMA_VERSION
+            if version != SCHEMA_VERSION:
+                raise SchemaMismatch(
+                    "database schema is version {}, expected {}".format(
+                        version, SCHEMA_VERSION,
+                    )
+                )
 
     @property
     def _session(self) -> Session:
-        """Memoized session object.
-        Creates a session for querying the database if not already created.
+        """Session object of the current thread.
+        Created on first use in each thread (i.e. each request).
+        """
+        return self.__session()
+
+    def close_session(self) -> None:
+        """Closes the current thread's session.
+        Returns its connection to the pool; called at request teardown.
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)  # Create session
-            self.__session = DBSession()  # Initialize session
-        return self.__session
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """Adds a new user to the database.
@@ -56,37 +246,142 @@ class DB:
         Uses keyword arguments to search for user attributes and returns
         the first matching user.
         """
-        fields, values = [], []  # Initialize fields and values lists
-        for key, value in kwargs.items():
-            if hasattr(User, key):  # Check if User model has the attribute
-                fields.append(getattr(User, key))  # Add field to list
-                values.append(value)  # Add value to list
-            else:
+        for key in kwargs:
+            if not hasattr(User, key):  # Check if User model has the attribute
                 raise InvalidRequestError()  # Raise error if invalid field
-        # Query the database for the user matching the filters
-        result = self._session.query(User).filter(
-            tuple_(*fields).in_([tuple(values)])
+        # Plain `column = value` terms, so SQLite can use the column indexes
+        result = self._session.query(User).filter_by(
+            **kwargs
         ).first()  # Get first matching result
         if result is None:
             raise NoResultFound()  # Raise exception if no user is found
         return result
 
-    def update_user(self, user_id: int, **kwargs) -> None:
-        """Updates a user based on a given id.
-        Takes user_id and keyword arguments for the fields to be updated.
+    def add_session(self, user_id: int, session_id: str,
+                    expires_at: datetime = None) -> UserSession:
+        """Adds a session of a user to the database.
+        Takes the user id, the session ID and the expiry (None for a
+        session that never expires) and returns the session object.
+        """
+        session = UserSession(
+            id=session_id,
+            user_id=user_id,
+            created_at=datetime.utcnow(),
+            expires_at=expires_at,
+        )
+        try:
+            self._session.add(session)  # Add session to session
+            self._session.commit()  # Commit changes to DB
+        except Exception:
+            self._session.rollback()  # Rollback in case of error
+            raise
+        return session
+
+    def find_session_user(self, session_id: str) -> Tuple[User, datetime]:
+        """Finds the user of a session that has not expired.
+        Returns the user and the session's expiry, in one query.
+
+        Raises:
+            NoResultFound: If the session doesn't exist or has expired.
+        """
+        result = self._session.query(User, UserSession.expires_at).join(
+            UserSession, UserSession.user_id == User.id
+        ).filter(
+            UserSession.id == session_id,
+            or_(
+                UserSession.expires_at.is_(None),
+                UserSession.expires_at > datetime.utcnow(),
+            ),
+        ).first()  # Get the session's user
+        if result is None:
+            raise NoResultFound()  # Raise exception if no session is found
+        return tuple(result)
+
+    def delete_sessions(self, user_id: int, session_id: str = None) -> int:
+        """Deletes one session of a user, or all of them.
+        Returns the number of deleted sessions.
+        """
+        statement = delete(UserSession).where(UserSession.user_id == user_id)
+        if session_id is not None:
+            statement = statement.where(UserSession.id == session_id)
+        return self._delete(statement)
+
+    def delete_expired_sessions(self, before: datetime = None,
+                                after: datetime = None) -> int:
+        """Deletes the sessions expired in a time range, in one statement.
+        Sessions expiring before `before` (default: now) and, if given,
+        at or after `after` are deleted. Returns the number deleted.
+        """
+        statement = delete(UserSession).where(
+            UserSession.expires_at < (before or datetime.utcnow())
+        )
+        if after is not None:
+            statement = statement.where(UserSession.expires_at >= after)
+        return self._delete(statement)
+
+    def _delete(self, statement) -> int:
+        """Runs a DELETE statement and commits it.
+        Returns the number of deleted rows.
+        """
+        try:
+            count = self._session.execute(
+                statement.execution_options(synchronize_session=False)
+            ).rowcount
+        except Exception:
+            self._session.rollback()  # Rollback in case of error
+            raise
+        self._session.commit()  # Commit changes to the database
+        return count
+
+    def _update(self, user_id: int, fields: dict) -> None:
+        """Issues one `UPDATE users ... WHERE id = ?` without committing.
+
+        Raises:
+            ValueError: If a field is not a User attribute.
+            NoResultFound: If no user has this id.
         """
-        user = self.find_user_by(id=user_id)  # Find user by id
-        if user is None:
-            return  # Return if user is not found
         update_source = {}  # Initialize dictionary to store updates
-        for key, value in kwargs.items():
+        for key, value in fields.items():
             if hasattr(User, key):  # Check if field is valid
                 update_source[getattr(User, key)] = value  # Add to updates
             else:
                 raise ValueError()  # Raise error if invalid field
-        # Perform the update in the database
-        self._session.query(User).filter(User.id == user_id).update(
+        # No SELECT first: the affected row count tells if the user exists
+        count = self._session.query(User).filter(User.id == user_id).update(
             update_source,
-            synchronize_session=False,  # Don't synchronize session
+            synchronize_session="evaluate",  # Refresh users already loaded
         )
+        if count == 0:
+            raise NoResultFound()  # Raise exception if no user is found
+
+    def update_user(self, user_id: int, **kwargs) -> None:
+        """Updates a user based on a given id.
+        Takes user_id and keyword arguments for the fields to be updated.
+
+        Raises:
+            ValueError: If a field is not a User attribute.
+            NoResultFound: If no user has this id.
+        """
+        try:
+            self._update(user_id, kwargs)
+        except Exception:
+            self._session.rollback()  # Rollback in case of error
+            raise
+        self._session.commit()  # Commit changes to the database
+
+    def update_users(self, updates: Dict[int, dict]) -> None:
+        """Updates many users in a single transaction.
+        Takes a dictionary of user id -> fields to be updated; either every
+        update is committed or none is.
+
+        Raises:
+            ValueError: If a field is not a User attribute.
+            NoResultFound: If one of the ids matches no user.
+        """
+        try:
+            for user_id, fields in updates.items():
+                self._update(user_id, fields)
+        except Exception:
+            self._session.rollback()  # Rollback in case of error
+            raise
         self._session.commit()  # Commit changes to the database
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""A module for running password hashing off the request threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+class PoolSaturated(Exception):
+    """Raised when too many hashing jobs are already waiting.
+    """
+
+
+class KDFPool:
+    """Bounded pool for expensive key derivation (bcrypt) calls.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more
+    may wait. Beyond that, callers wait up to `timeout` seconds for a slot
+    and then get PoolSaturated, so a login storm is rejected early instead
+    of piling up and starving cheap requests.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int,
+                 timeout: float) -> None:
+        """Initializes a new KDFPool instance.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="kdf")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._timeout = timeout
+
+    def run(self, fn, *args):
+        """Runs `fn(*args)` on the pool and returns its result.
+
+        Raises:
+            PoolSaturated: If no slot frees up within the timeout.
+        """
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolSaturated()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
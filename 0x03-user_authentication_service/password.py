@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""A module for password hashing with a cost tuned to the host.
+"""
+import threading
+import time
+
+import bcrypt
+
+
+class BcryptHasher:
+    """bcrypt password hasher whose cost is calibrated on first use.
+
+    Every hash carries its algorithm and cost (`$2b$<rounds>$...`), so
+    hashes made with other parameters are recognized and can be replaced
+    on the next successful login (see `needs_rehash`).
+    """
+    name = "bcrypt"
+    MIN_ROUNDS = 4
+    MAX_ROUNDS = 16
+
+    def __init__(self, rounds: int = None, target_ms: float = 250) -> None:
+        """Initializes a new BcryptHasher.
+
+        Args:
+            rounds (int): Fixed cost; calibrated to `target_ms` if None.
+            target_ms (float): Wanted duration of one hash.
+        """
+        self._rounds = rounds
+        self._fixed = rounds is not None
+        self.target_ms = target_ms
+        self._lock = threading.Lock()
+
+    @property
+    def rounds(self) -> int:
+        """Cost used for new hashes.
+        """
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = self.calibrate()
+        return self._rounds
+
+    def calibrate(self) -> int:
+        """Finds the cost whose hashing time is closest to the target.
+
+        Each extra round doubles the work, so one timing at a cheap cost
+        is enough to extrapolate.
+        """
+        probe = 8
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(probe))
+        elapsed_ms = max((time.perf_counter() - start) * 1000, 1e-3)
+        rounds = probe
+        while rounds < self.MAX_ROUNDS and \
+                elapsed_ms * 2 ** (rounds + 1 - probe) <= self.target_ms * 1.5:
+            rounds += 1
+        return max(self.MIN_ROUNDS, rounds)
+
+    def hash(self, password: str) -> bytes:
+        """Hashes a password with the current cost.
+        """
+        return bcrypt.hashpw(password.encode("utf-8"),
+                             bcrypt.gensalt(self.rounds))
+
+    def verify(self, password: str, hashed_password: bytes) -> bool:
+        """Checks a password against a hash.
+        """
+        return bcrypt.checkpw(password.encode("utf-8"), hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Tells whether a hash was made with other parameters.
+
+        A calibrated cost tolerates one round of difference, so timing
+        noise between restarts doesn't rehash every password.
+        """
+        try:
+            rounds = int(hashed_password.split(b"$")[2])
+        except (IndexError, ValueError):
+            return True
+        tolerance = 0 if self._fixed else 1
+        return abs(rounds - self.rounds) > tolerance
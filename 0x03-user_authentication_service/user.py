@@ -3,12 +3,19 @@
 Defines the database model for the `users` table.
 """
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 # Create a base class for declarative class definitions
 Base = declarative_base()
 
+# Version of the tables below; bump it on every schema change
+SCHEMA_VERSION = 2
+
+# Older versions create_all upgrades: every change since only added tables
+# (2: the `sessions` table)
+ADDITIVE_VERSIONS = (1,)
+
 
 class User(Base):
     """Represents a record from the `users` table.
@@ -20,14 +27,45 @@ class User(Base):
     # Unique identifier for each user (Primary Key)
     id = Column(Integer, primary_key=True)
 
-    # User's email address (required and unique)
-    email = Column(String(250), nullable=False)
+    # User's email address (required and unique, indexed for logins)
+    email = Column(String(250), nullable=False, unique=True, index=True)
 
     # Hashed password for user authentication (required)
     hashed_password = Column(String(250), nullable=False)
 
-    # Optional session ID for tracking active sessions
-    session_id = Column(String(250), nullable=True)
+    # Legacy single session ID, superseded by the `sessions` table
+    session_id = Column(String(250), nullable=True, index=True)
 
     # Optional token used for password reset requests
-    reset_token = Column(String(250), nullable=True)
+    reset_token = Column(String(250), nullable=True, index=True)
+
+
+class UserSession(Base):
+    """Represents a record from the `sessions` table.
+
+    A user has one record per logged in device, so logins and logouts
+    never write the `users` row.
+    """
+    __tablename__ = "sessions"
+
+    # The session ID given to the client
+    id = Column(String(250), primary_key=True)
+
+    # Owner of the session, indexed to destroy all of a user's sessions
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False,
+                     index=True)
+
+    created_at = Column(DateTime, nullable=False)
+
+    # None for sessions that never expire, indexed for bulk expiry
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+
+class SchemaVersion(Base):
+    """Represents the single record of the `schema_version` table.
+
+    It stores the SCHEMA_VERSION the database was created with.
+    """
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)